@@ -4,48 +4,51 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tennis_reservation_app.settings')
 django.setup()
 
-from telegram import Update
+import asyncio
+import functools
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import Application, CommandHandler, CallbackContext, CallbackQueryHandler
-from app.models import Reservation, Admin, AdminSession
-from django.contrib.auth.hashers import check_password
+from app.models import DURATION_TO_PRICE
+from app import events, repository, stats
 from django.conf import settings
-from asgiref.sync import sync_to_async
+from app.instrumentation import instrument_application, instrument_builder
+from app.notifications import TelegramNotifier
 
-@sync_to_async
-def verify_login(username, password):
-    try:
-        admin = Admin.objects.get(username=username)
-        if check_password(password, admin.password):
-            return admin.id
-    except Admin.DoesNotExist:
-        return None
-
-@sync_to_async
-def delete_reservation(reservation_id):
-    try:
-        reservation = Reservation.objects.get(id=reservation_id)
-        reservation.delete()
-        return True
-    except Reservation.DoesNotExist:
-        return False
-
-@sync_to_async
-def confirm_reservation_by_id(reservation_id):
-    try:
-        reservation = Reservation.objects.get(id=reservation_id)
-        reservation.confirmed = True
-        reservation.save()
-        return True
-    except Reservation.DoesNotExist:
-        return False
+# Most ids a single /confirm or /cancel may expand to
+MAX_SELECTION = 500
 
-@sync_to_async
-def create_admin_session(chat_id):
-    return AdminSession.objects.get_or_create(chat_id=chat_id)
+def parse_selection(args, allow_dates=False):
+    # "12 13 14", "10-20" and, where allowed, "2024-08-10" for every pending reservation on that date
+    ids, dates = set(), set()
+    for arg in args:
+        try:
+            if allow_dates and arg.count('-') == 2:
+                dates.add(datetime.strptime(arg, '%Y-%m-%d').date())
+                continue
+            if arg.count('-') == 1:
+                first, last = (int(part) for part in arg.split('-'))
+            else:
+                first = last = int(arg)
+        except ValueError:
+            raise ValueError(f'Invalid selection: {arg}')
+        # Checked before expanding, a huge range would block the event loop
+        if last < first:
+            raise ValueError(f'Invalid selection: {arg}')
+        if len(ids) + last - first + 1 > MAX_SELECTION:
+            raise ValueError(f'At most {MAX_SELECTION} ids at once.')
+        ids.update(range(first, last + 1))
+    if not ids and not dates:
+        raise ValueError('Nothing selected.')
+    return sorted(ids), sorted(dates)
 
-@sync_to_async
-def get_admin_sessions():
-    return AdminSession.objects.all()
+def summarize(action, requested, found):
+    found_text = ', '.join(map(str, found))
+    reply = f'{action} {len(found)} reservation(s): {found_text}.' if found else 'No matching reservations.'
+    missing = sorted(set(requested) - set(found))
+    if missing:
+        reply += f"\nNot found: {', '.join(map(str, missing))}."
+    return reply
 
 async def login(update: Update, context: CallbackContext):
     if len(context.args) != 2:
@@ -53,65 +56,219 @@ async def login(update: Update, context: CallbackContext):
         return
 
     username, password = context.args
-    admin_id = await verify_login(username, password)
-    if admin_id:
-        context.user_data['admin_logged_in'] = True
-        await create_admin_session(update.effective_chat.id)
+    # Credentials checked and the admin session started in one database call
+    if await repository.login(username, password, update.effective_chat.id, update.effective_user.id):
         await update.message.reply_text('Login successful!')
     else:
         await update.message.reply_text('Login failed. Invalid credentials.')
 
-async def cancel_reservation(update: Update, context: CallbackContext):
-    if 'admin_logged_in' not in context.user_data or not context.user_data['admin_logged_in']:
+async def logout(update: Update, context: CallbackContext):
+    # Stops booking notifications to this chat
+    await repository.logout(update.effective_chat.id)
+    await update.message.reply_text('Logged out.')
+
+async def logged_in(update: Update, context: CallbackContext):
+    # The chat's session and the user who started it, checked against the in-memory session cache
+    if await repository.is_admin(update.effective_chat.id, update.effective_user.id):
+        return True
+    if update.callback_query:
+        await update.callback_query.answer('Please log in first using /login.')
+    else:
         await update.message.reply_text('Please log in first using /login.')
+    return False
+
+async def cancel_reservation(update: Update, context: CallbackContext):
+    if not await logged_in(update, context):
         return
 
-    reservation_id = context.args[0]
-    success = await delete_reservation(reservation_id)
-    if success:
-        await update.message.reply_text(f'Reservation {reservation_id} has been cancelled.')
-    else:
-        await update.message.reply_text(f'Reservation {reservation_id} not found.')
+    try:
+        ids, _ = parse_selection(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f'{e}\nUsage: /cancel <id> [<id> ...] or /cancel <first id>-<last id>')
+        return
+
+    found = await repository.cancel_reservations(ids)
+    await update.message.reply_text(summarize('Cancelled', ids, found))
 
 async def confirm_reservation(update: Update, context: CallbackContext):
-    if 'admin_logged_in' not in context.user_data or not context.user_data['admin_logged_in']:
-        await update.message.reply_text('Please log in first using /login.')
+    if not await logged_in(update, context):
         return
 
-    reservation_id = context.args[0]
-    success = await confirm_reservation_by_id(reservation_id)
-    if success:
-        await update.message.reply_text(f'Reservation {reservation_id} has been confirmed.')
-    else:
-        await update.message.reply_text(f'Reservation {reservation_id} not found.')
+    try:
+        ids, dates = parse_selection(context.args, allow_dates=True)
+    except ValueError as e:
+        await update.message.reply_text(
+            f'{e}\nUsage: /confirm <id> [<id> ...], /confirm <first id>-<last id> '
+            'or /confirm <YYYY-MM-DD> to confirm every pending reservation on that date'
+        )
+        return
+
+    found = await repository.confirm_reservations(ids, dates)
+    await update.message.reply_text(summarize('Confirmed', ids, found))
+
+def format_stats(summary):
+    count, revenue, occupancy = summary['count'], summary['revenue'], summary['occupancy']
+    lines = [
+        f"Stats for {summary['date_from']} - {summary['date_to']} ({summary['period']})",
+        f"Occupancy: {occupancy.get('confirmed', 0):.1f}% confirmed, {occupancy.get('pending', 0):.1f}% pending",
+        f"Reservations: {count['confirmed']} confirmed, {count['pending']} pending",
+        f"Revenue: {revenue['confirmed']} UAH confirmed, {revenue['pending']} UAH pending",
+    ]
+    if summary['tiers']:
+        lines.append('Confirmed revenue by duration:')
+        for duration, tier in sorted(summary['tiers'].items()):
+            lines.append(f"  {duration / 60:g} h: {tier['count']} x {DURATION_TO_PRICE.get(duration, 0)} = {tier['revenue']} UAH")
+    busiest = [f'{hour:02d}:00 ({n})' for hour, n in summary['hours'].most_common(3) if n]
+    if busiest:
+        lines.append(f"Busiest start hours: {', '.join(busiest)}")
+    return '\n'.join(lines)
+
+async def show_stats(update: Update, context: CallbackContext):
+    if not await logged_in(update, context):
+        return
+
+    period = context.args[0] if context.args else 'day'
+    if period not in stats.PERIODS:
+        await update.message.reply_text(f"Usage: /stats [{'|'.join(stats.PERIODS)}]")
+        return
+
+    await update.message.reply_text(format_stats(await repository.period_stats(period)))
 
 async def handle_callback_query(update: Update, context: CallbackContext):
+    if not await logged_in(update, context):
+        return
+
     query = update.callback_query
     data = query.data.split('_')
 
     if data[0] == 'confirm':
         reservation_id = int(data[1])
-        success = await confirm_reservation_by_id(reservation_id)
+        success = await repository.confirm_reservations([reservation_id])
         if success:
             await query.answer('Reservation confirmed.')
             await query.edit_message_text(f'Reservation {reservation_id} has been confirmed.')
         else:
             await query.answer('Reservation not found.')
+    elif data[0] == 'confirmseries':
+        series_id = int(data[1])
+        found = await repository.confirm_reservations(series=[series_id])
+        if found:
+            await query.answer('Series confirmed.')
+            await query.edit_message_text(f'{len(found)} reservation(s) of series {series_id} have been confirmed.')
+        else:
+            await query.answer('Series not found.')
+    elif data[0] == 'cancelseries':
+        series_id = int(data[1])
+        found = await repository.cancel_reservations(series=[series_id])
+        if found:
+            await query.answer('Series canceled.')
+            await query.edit_message_text(f'{len(found)} reservation(s) of series {series_id} have been canceled.')
+        else:
+            await query.answer('Series not found.')
     elif data[0] == 'cancel':
         reservation_id = int(data[1])
-        success = await delete_reservation(reservation_id)
+        success = await repository.cancel_reservations([reservation_id])
         if success:
             await query.answer('Reservation canceled.')
             await query.edit_message_text(f'Reservation {reservation_id} has been canceled.')
         else:
             await query.answer('Reservation not found.')
 
-if __name__ == '__main__':
-    application = Application.builder().token(settings.ADMIN_BOT_TOKEN).build()
+def format_new_reservation(event):
+    data = event.data
+    message = f"🔔 Нове бронювання на {data['date']} о {data['time']} на {data['duration'] / 60} години.\n"
+    message += f"🏓 Стіл: {data['court']}\n"
+    message += f"📋 Контактні дані: {data['text']}\n"
+    message += f"💬 Telegram: @{data['username']}"
+    keyboard = [
+        [InlineKeyboardButton("✅ Confirm", callback_data=f'confirm_{event.reservation_id}'),
+         InlineKeyboardButton("❌ Cancel", callback_data=f'cancel_{event.reservation_id}')]
+    ]
+    return message, InlineKeyboardMarkup(keyboard)
+
+def format_new_series(event):
+    occurrences = event.data['reservations']
+    first = occurrences[0]
+    message = f"🔁 Нове щотижневе бронювання ({len(occurrences)} раз.) о {first['time']} на {first['duration'] / 60} години:\n"
+    message += "\n".join(f"📅 {data['date']}, {data['court']} (#{data['id']})" for data in occurrences) + "\n"
+    message += f"📋 Контактні дані: {first['text']}\n"
+    message += f"💬 Telegram: @{first['username']}"
+    keyboard = [
+        [InlineKeyboardButton("✅ Confirm all", callback_data=f'confirmseries_{event.reservation_id}'),
+         InlineKeyboardButton("❌ Cancel all", callback_data=f'cancelseries_{event.reservation_id}')]
+    ]
+    return message, InlineKeyboardMarkup(keyboard)
+
+def format_expired(expired):
+    message = f"⌛ Скасовано неоплачені бронювання ({len(expired)}):\n"
+    message += "\n".join(
+        f"#{event.reservation_id} {event.data['date']} о {event.data['time']}, {event.data['court']}, "
+        f"{event.data['text']}, @{event.data['username']}"
+        for event in expired
+    )
+    return message, None
+
+async def notify_admins(notifier, booking_events):
+    # Booking event consumer: every new reservation or weekly series, and one summary of the expired
+    # ones, to each logged-in admin chat
+    formatters = {events.CREATED: format_new_reservation, events.SERIES_CREATED: format_new_series}
+    messages = [formatters[event.kind](event) for event in booking_events if event.kind in formatters]
+    expired = [event for event in booking_events if event.kind == events.EXPIRED]
+    if expired:
+        messages.append(format_expired(expired))
+    chat_ids = await repository.admin_chat_ids()
+    if not messages or not chat_ids:
+        return []
+    results = await notifier.send_messages(
+        [(chat_id, text, reply_markup) for text, reply_markup in messages for chat_id in chat_ids]
+    )
+    for result in results:
+        if not result.ok:
+            print(f"Error notifying admin {result.chat_id}: {result.error}")
+
+    # A message no admin got because of a passing failure fails the batch, so the relay keeps its
+    # cursor and delivers the batch again on the next poll
+    for start in range(0, len(results), len(chat_ids)):
+        attempts = results[start:start + len(chat_ids)]
+        if not any(result.ok for result in attempts) and any(result.retryable for result in attempts):
+            raise RuntimeError(f'No admin could be notified: {attempts[0].error}')
+    return results
+
+# Retries, backoff and concurrency of the notifications are TelegramNotifier's, the same as for players
+admin_notifier = TelegramNotifier(settings.ADMIN_BOT_TOKEN)
+notification_tasks = []
+
+async def start_notifications(application):
+    # Durable consumer: notifications missed while the bot was down are sent once it is back
+    relay = events.EventRelay(functools.partial(notify_admins, admin_notifier), 'admin_notifications')
+    notification_tasks.append(asyncio.create_task(relay.run(settings.EVENT_POLL_INTERVAL)))
+
+async def stop_notifications(application):
+    for task in notification_tasks:
+        task.cancel()
+    notification_tasks.clear()
+    await admin_notifier.aclose()
+
+def build_application(builder=None, request=None):
+    builder = instrument_builder(builder or Application.builder(), request)
+    # Stateless: the admin sessions live in the AdminSession table, nothing is kept in user_data
+    application = (
+        builder.token(settings.ADMIN_BOT_TOKEN)
+        .post_init(start_notifications).post_shutdown(stop_notifications).build()
+    )
 
     application.add_handler(CommandHandler("login", login))
+    application.add_handler(CommandHandler("logout", logout))
     application.add_handler(CommandHandler("cancel", cancel_reservation))
     application.add_handler(CommandHandler("confirm", confirm_reservation))
+    application.add_handler(CommandHandler("stats", show_stats))
     application.add_handler(CallbackQueryHandler(handle_callback_query))  # For handling button presses
+    return instrument_application(application, 'admin_bot')
+
 
-    application.run_polling()
+if __name__ == '__main__':
+    if settings.BOT_MODE == 'webhook':
+        # Both bots are served by the ASGI application (tennis_reservation_app.asgi) instead
+        print("BOT_MODE is 'webhook', not polling.")
+    else:
+        build_application().run_polling()
@@ -1,5 +1,47 @@
 from django.contrib import admin
-from .models import Admin, Reservation, AdminSession
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+from . import booking, events, search, stats
+from .models import Admin, Court, Reservation, AdminSession
+
+
+# Ids per confirm/cancel statement of the bulk actions
+ACTION_BATCH_SIZE = 500
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never counts every row of a big table.
+
+    The unfiltered list uses the database's own row estimate; filtered lists are counted exactly
+    up to COUNT_LIMIT rows, and shown as having COUNT_LIMIT rows beyond that.
+    """
+
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimate_rows(self.object_list.model)
+            if estimate is not None and estimate > self.COUNT_LIMIT:
+                return estimate
+        return self.object_list.order_by()[:self.COUNT_LIMIT].count()
+
+
+def estimate_rows(model):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'sqlite':
+            # Ids are never reused, so this is only off by the number of deleted rows
+            cursor.execute(f'SELECT MAX(id) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
 
 
 @admin.register(Admin)
@@ -8,10 +50,70 @@ class AdminAdmin(admin.ModelAdmin):
     search_fields = ('username',)
 
 
+@admin.register(Court)
+class CourtAdmin(admin.ModelAdmin):
+    list_display = ('name', 'is_active')
+    list_filter = ('is_active',)
+
+
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
-    list_display = ('start_date', 'start_time', 'duration', 'username', 'text', 'created_at')
+    list_display = ('start_date', 'start_time', 'duration', 'court', 'username', 'text', 'confirmed', 'created_at')
     search_fields = ('username', 'text')
-    list_filter = ('start_date', 'created_at')
+    # Every filter and the ordering are served by an index of Reservation.Meta. No date_hierarchy:
+    # its year links take a DISTINCT over the whole table, the start_date filter needs no query
+    list_filter = ('confirmed', 'court', 'start_date', 'created_at')
+    ordering = ('-start_date', '-start_time')
+    list_select_related = ('court',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('confirm_selected', 'cancel_selected')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index where the backend has one, see app/search.py
+        ids = search.matching_ids(search_term, connection)
+        if ids is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id__in=ids), False
+
+    def selected_ids(self, queryset):
+        # In batches, "select all" can cover far more ids than one statement may hold
+        ids = list(queryset.order_by().values_list('id', flat=True))
+        return (ids[i:i + ACTION_BATCH_SIZE] for i in range(0, len(ids), ACTION_BATCH_SIZE))
+
+    @admin.action(description='Confirm selected reservations')
+    def confirm_selected(self, request, queryset):
+        confirmed = sum(len(booking.confirm_reservations(ids)) for ids in self.selected_ids(queryset))
+        self.message_user(request, f'Confirmed {confirmed} reservation(s).')
+
+    @admin.action(description='Cancel (delete) selected reservations')
+    def cancel_selected(self, request, queryset):
+        cancelled = sum(len(booking.cancel_reservations(ids)) for ids in self.selected_ids(queryset))
+        self.message_user(request, f'Cancelled {cancelled} reservation(s).')
+
+    # Keep the DailyStats rollup in step with edits made here and tell the bots about them
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            booking.lock_writes()
+            if change:
+                stats.record([Reservation.objects.get(pk=obj.pk)], -1)
+            super().save_model(request, obj, form, change)
+            stats.record([obj])
+            events.publish(events.CHANGED if change else events.CREATED, [obj], details=True)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            booking.lock_writes()
+            stats.record([obj], -1)
+            events.publish(events.CANCELLED, [obj])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            booking.lock_writes()
+            deleted = list(queryset.only(*booking.STATS_FIELDS))
+            stats.record(deleted, -1)
+            events.publish(events.CANCELLED, deleted)
+            super().delete_queryset(request, queryset)
 
 admin.site.register(AdminSession)
\ No newline at end of file
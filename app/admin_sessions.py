@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.utils import timezone
+
+from .models import AdminSession
+
+
+class AdminRegistry:
+    """In-process cache of the admin sessions: recipients of booking notifications and the chats
+    allowed to run admin commands, checked without touching the database."""
+
+    def __init__(self, ttl=300, session_days=30):
+        self.ttl = ttl
+        self.session_days = session_days
+        self._lock = threading.Lock()
+        self._sessions = {}  # chat_id -> (Telegram user id or None for sessions made before it was kept, expires_at)
+        self._loaded_at = None
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    @staticmethod
+    def is_active(expires_at, now):
+        # Sessions without an expiry (made before /login set one, or cleared in the Django admin) never expire
+        return expires_at is None or expires_at > now
+
+    def chat_ids(self):
+        now = timezone.now()
+        return sorted(chat_id for chat_id, (_, expires_at) in self._sessions.items() if self.is_active(expires_at, now))
+
+    def is_authorized(self, chat_id, user_id):
+        # Whether the chat has an unexpired session started by this Telegram user; a dict lookup
+        session = self._sessions.get(str(chat_id))
+        if session is None or session[0] is None:
+            return False
+        session_user_id, expires_at = session
+        return session_user_id == user_id and self.is_active(expires_at, timezone.now())
+
+    def load(self):
+        # Expired sessions are dropped whenever the cache is reloaded
+        AdminSession.objects.filter(expires_at__lte=timezone.now()).delete()
+        sessions = {
+            chat_id: (user_id, expires_at)
+            for chat_id, user_id, expires_at in AdminSession.objects.values_list('chat_id', 'user_id', 'expires_at')
+        }
+        with self._lock:
+            self._sessions = sessions
+            self._loaded_at = time.monotonic()
+
+    def login(self, chat_id, user_id, admin):
+        # Start a new session of the user in the chat, replacing any previous one
+        session = (user_id, timezone.now() + timedelta(days=self.session_days))
+        AdminSession.objects.update_or_create(
+            chat_id=str(chat_id), defaults={'admin': admin, 'user_id': session[0], 'expires_at': session[1]}
+        )
+        with self._lock:
+            self._sessions[str(chat_id)] = session
+
+    def logout(self, chat_id):
+        deleted, _ = AdminSession.objects.filter(chat_id=str(chat_id)).delete()
+        with self._lock:
+            self._sessions.pop(str(chat_id), None)
+        return bool(deleted)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+
+admin_registry = AdminRegistry(ttl=settings.ADMIN_SESSION_CACHE_TTL, session_days=settings.ADMIN_SESSION_DAYS)
+
+# Admin id -> (stored password hash, HMAC of the password that matched it) of this process, so that
+# logging in again skips the deliberately slow password hasher. The key never leaves the process.
+_verified_passwords = {}
+_password_key = secrets.token_bytes(32)
+
+
+def verify_password(admin, password):
+    digest = hmac.new(_password_key, password.encode(), hashlib.sha256).digest()
+    cached = _verified_passwords.get(admin.id)
+    # A changed password hash (new password, other hasher) misses the cache
+    if cached is not None and cached[0] == admin.password and hmac.compare_digest(cached[1], digest):
+        return True
+    if not check_password(password, admin.password):
+        return False
+    _verified_passwords[admin.id] = (admin.password, digest)
+    return True
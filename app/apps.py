@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from .db import configure_sqlite
+        from .search import install_search_index
+
+        connection_created.connect(configure_sqlite)
+        post_migrate.connect(install_search_index, sender=self)
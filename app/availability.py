@@ -0,0 +1,207 @@
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .events import CANCELLED, CHANGED, CREATED, EXPIRED, SERIES_CREATED
+from .models import Court, Reservation
+
+SLOT_MINUTES = 30
+OPENING_TIME = 9 * 60   # 9:00
+CLOSING_TIME = 23 * 60  # 23:00
+CELLS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+def booking_mask(date, start, end):
+    # Bitmap of the 30-minute cells of `date` covered by [start, end), bit N = cell starting at N * 30 minutes
+    midnight = datetime.combine(date, datetime.min.time())
+    start = (timezone.localtime(start).replace(tzinfo=None) - midnight).total_seconds() // 60
+    end = (timezone.localtime(end).replace(tzinfo=None) - midnight).total_seconds() // 60
+    first = max(int(start) // SLOT_MINUTES, 0)
+    last = min(-(-int(end) // SLOT_MINUTES), CELLS_PER_DAY)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+class AvailabilityIndex:
+    """Per-date, per-court occupancy bitmaps answering free-slot lookups without touching the database."""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.courts = {}        # court_id -> name of every active court, in booking order
+        self._courts_loaded_at = None
+        self._days = {}         # date -> {reservation_id: (court_id, mask)}
+        self._occupancy = {}    # date -> {court_id: OR of the masks of that court}
+        self._loaded_at = {}    # date -> monotonic time of the last full load
+        self._dates = {}        # reservation_id -> dates it occupies
+        self._versions = {}     # date -> changes whenever the date's occupancy may have changed
+        self._counter = itertools.count(1)
+
+    def version(self, date):
+        return self._versions.get(date, 0)
+
+    def is_fresh(self, date):
+        loaded_at = self._loaded_at.get(date)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def courts_fresh(self):
+        return self._courts_loaded_at is not None and time.monotonic() - self._courts_loaded_at < self.ttl
+
+    def load_courts(self, courts):
+        # (id, name) rows of the active courts
+        courts = dict(courts)
+        with self._lock:
+            if courts != self.courts:
+                self.courts = courts
+                # Free slots of every date depend on which courts exist
+                for date in self._versions:
+                    self._versions[date] = next(self._counter)
+            self._courts_loaded_at = time.monotonic()
+
+    def load(self, date, reservations):
+        # Replace everything known about `date` with (id, court_id, start_datetime, end_datetime) rows
+        self.load_range([date], reservations)
+
+    def load_range(self, dates, reservations):
+        # Same as load() for several dates at once, every row is spread over the dates it touches
+        days = {date: {} for date in dates}
+        for pk, court_id, start, end in reservations:
+            date = timezone.localtime(start).date()
+            while date <= timezone.localtime(end).date():
+                if date in days:
+                    mask = booking_mask(date, start, end)
+                    if mask:
+                        days[date][pk] = (court_id, mask)
+                date += timedelta(days=1)
+
+        now = time.monotonic()
+        with self._lock:
+            for date, bookings in days.items():
+                self._forget(date)
+                self._days[date] = bookings
+                self._occupancy[date] = self._combine(bookings)
+                self._versions[date] = next(self._counter)
+                for pk in bookings:
+                    self._dates.setdefault(pk, set()).add(date)
+                self._loaded_at[date] = now
+            # Days that have passed are never asked for again, drop them so the cache stays one window wide
+            today = timezone.localdate()
+            for date in [date for date in self._versions if date < today and date not in days]:
+                self._forget(date)
+                del self._versions[date]
+
+    def add(self, reservation_id, court_id, start, end):
+        with self._lock:
+            # Only cached days are updated, the others pick the booking up when they are loaded
+            for date in self._days:
+                mask = booking_mask(date, start, end)
+                # Already known (an event about a booking this process made itself) changes nothing
+                if mask and self._days[date].get(reservation_id) != (court_id, mask):
+                    self._days[date][reservation_id] = (court_id, mask)
+                    occupancy = self._occupancy[date]
+                    occupancy[court_id] = occupancy.get(court_id, 0) | mask
+                    self._versions[date] = next(self._counter)
+                    self._dates.setdefault(reservation_id, set()).add(date)
+
+    def remove(self, reservation_id):
+        with self._lock:
+            for date in self._dates.pop(reservation_id, ()):
+                bookings = self._days[date]
+                bookings.pop(reservation_id, None)
+                self._occupancy[date] = self._combine(bookings)
+                self._versions[date] = next(self._counter)
+
+    def apply(self, events):
+        # Booking events (app/events.py) from any process; the booking functions already applied the
+        # ones made by this process, applying them again changes nothing
+        for event in events:
+            if event.kind in (CANCELLED, EXPIRED, CHANGED):
+                self.remove(event.reservation_id)
+            if event.kind in (CREATED, CHANGED):
+                data = event.data
+                self.add(
+                    event.reservation_id, data['court_id'],
+                    datetime.fromisoformat(data['start']), datetime.fromisoformat(data['end']),
+                )
+            if event.kind == SERIES_CREATED:
+                for data in event.data['reservations']:
+                    self.add(
+                        data['id'], data['court_id'],
+                        datetime.fromisoformat(data['start']), datetime.fromisoformat(data['end']),
+                    )
+
+    def _forget(self, date):
+        for pk in self._days.pop(date, ()):
+            dates = self._dates.get(pk)
+            dates.discard(date)
+            if not dates:
+                del self._dates[pk]
+        self._occupancy.pop(date, None)
+        self._loaded_at.pop(date, None)
+        self._versions[date] = next(self._counter)
+
+    def free_starts(self, date, duration, earliest=OPENING_TIME, court_id=None):
+        # {court_id: bitmap of the cells where `duration` can start on that court and end before closing time},
+        # for `court_id` only or for every active court
+        occupancy = self._occupancy.get(date, {})
+        cells = -(-duration // SLOT_MINUTES)
+        first = -(-earliest // SLOT_MINUTES)
+        last = (CLOSING_TIME - duration) // SLOT_MINUTES
+        allowed = ((1 << (last - first + 1)) - 1) << first if last >= first else 0
+        starts = {}
+        for court in (self.courts if court_id is None else [court_id]):
+            # A start cell is blocked when any of the `cells` cells from it on is busy
+            busy = occupancy.get(court, 0)
+            blocked = 0
+            for shift in range(cells):
+                blocked |= busy >> shift
+            starts[court] = allowed & ~blocked
+        return starts
+
+    def free_slots(self, date, duration, earliest=OPENING_TIME, court_id=None):
+        # (start time in minutes from midnight, first court free for all of `duration`) for every start time
+        slots = []
+        taken = 0
+        for court, starts in self.free_starts(date, duration, earliest, court_id).items():
+            starts &= ~taken
+            taken |= starts
+            slots.extend((cell * SLOT_MINUTES, court) for cell in range(CELLS_PER_DAY) if starts >> cell & 1)
+        return sorted(slots)
+
+    def free_start_times(self, date, duration, earliest=OPENING_TIME, court_id=None):
+        return [minutes for minutes, _ in self.free_slots(date, duration, earliest, court_id)]
+
+    def free_slot_count(self, date, duration, earliest=OPENING_TIME, court_id=None):
+        # Number of start times with some court free, without listing them
+        starts = 0
+        for court_starts in self.free_starts(date, duration, earliest, court_id).values():
+            starts |= court_starts
+        return starts.bit_count()
+
+    @staticmethod
+    def _combine(bookings):
+        occupancy = {}
+        for court_id, mask in bookings.values():
+            occupancy[court_id] = occupancy.get(court_id, 0) | mask
+        return occupancy
+
+
+availability_index = AvailabilityIndex(ttl=settings.AVAILABILITY_INDEX_TTL)
+
+
+def refresh_courts():
+    availability_index.load_courts(Court.objects.filter(is_active=True).values_list('id', 'name'))
+
+
+def refresh_range(date_from, date_to):
+    # One query for the whole range, however many days it covers
+    if not availability_index.courts_fresh():
+        refresh_courts()
+    reservations = Reservation.objects.for_range(date_from, date_to).values_list(
+        'id', 'court_id', 'start_datetime', 'end_datetime'
+    )
+    dates = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    availability_index.load_range(dates, reservations)
@@ -0,0 +1,180 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import time as dt_time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from telegram.request import BaseRequest
+
+from . import stats
+from .availability import CLOSING_TIME, OPENING_TIME, SLOT_MINUTES
+from .models import DURATION_TO_PRICE, Admin, AdminSession, Court, Reservation, local_datetime
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {f'p{point}': 0.0 for point in points}
+    return {f'p{point}': ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points}
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.2f} ms'
+
+
+@contextlib.contextmanager
+def benchmark_database(on_disk=False):
+    # Throwaway copy of the schema on the configured backend; on_disk keeps SQLite in a file
+    # so that several processes can share it
+    tmp_dir = tempfile.mkdtemp()
+    if on_disk and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def create_courts(count):
+    # Courts "Стіл 1" to "Стіл <count>", the migrations already made the first one
+    existing = set(Court.objects.values_list('name', flat=True))
+    Court.objects.bulk_create(
+        Court(name=name) for name in (f'Стіл {number}' for number in range(1, count + 1)) if name not in existing
+    )
+
+
+FIRST_NAMES = ('Андрій', 'Олена', 'Тарас', 'Ірина', 'Богдан', 'Марія', 'Олег', 'Наталія', 'Дмитро', 'Юлія')
+LAST_NAMES = ('Шевченко', 'Коваленко', 'Бондаренко', 'Ткаченко', 'Кравченко', 'Мельник', 'Бойко', 'Лисенко')
+
+# Chance that a free table gets booked from a given hour: quiet mornings, busy evenings
+BOOKING_CHANCE = {hour: 0.15 if hour < 12 else 0.3 if hour < 17 else 0.8 for hour in range(24)}
+# Short games are the most popular
+DURATION_WEIGHTS = {60: 5, 90: 3, 120: 2, 180: 1}
+CONFIRMED_SHARE = 0.85
+PLAYERS = 5000
+
+
+def generate_reservations(count, courts, seed=0, last_day=None):
+    # Deterministic, non-overlapping reservations that fill `courts` day after day backwards from last_day
+    rng = random.Random(seed)
+    day = last_day or timezone.localdate()
+    durations = [duration for duration in DURATION_WEIGHTS if duration in DURATION_TO_PRICE]
+    players = [
+        (f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}, +38050{rng.randrange(10 ** 7):07d}', 100000 + number)
+        for number in range(PLAYERS)
+    ]
+    made = 0
+    while True:
+        for court in courts:
+            minutes = OPENING_TIME
+            while minutes < CLOSING_TIME:
+                if rng.random() >= BOOKING_CHANCE[minutes // 60]:
+                    minutes += SLOT_MINUTES
+                    continue
+                fitting = [duration for duration in durations if minutes + duration <= CLOSING_TIME]
+                if not fitting:
+                    break
+                duration = rng.choices(fitting, [DURATION_WEIGHTS[duration] for duration in fitting])[0]
+                start_time = dt_time(minutes // 60, minutes % 60)
+                start = local_datetime(day, start_time)
+                text, chat_id = rng.choice(players)
+                yield Reservation(
+                    court=court, start_date=day, start_time=start_time, duration=duration,
+                    start_datetime=start, end_datetime=start + timedelta(minutes=duration),
+                    text=text, username=f'player{chat_id}', chat_id=chat_id,
+                    confirmed=rng.random() < CONFIRMED_SHARE,
+                )
+                made += 1
+                if made == count:
+                    return
+                minutes += duration
+        day -= timedelta(days=1)
+
+
+def seed_reservations(count, courts=10, seed=0, last_day=None, batch_size=5000):
+    # In one transaction; bulk_create skips Reservation.save(), generate_reservations() fills
+    # the span fields itself
+    with transaction.atomic():
+        create_courts(courts)
+        rows = generate_reservations(count, list(Court.objects.filter(is_active=True)), seed, last_day)
+        while batch := list(itertools.islice(rows, batch_size)):
+            Reservation.objects.bulk_create(batch)
+        stats.rebuild()
+
+
+def seed_admins(count, sessions, password='admin'):
+    # Admins "admin1" to "admin<count>" sharing one password, hashed once, and logged in admin chats
+    hashed = make_password(password)
+    Admin.objects.bulk_create(
+        (Admin(username=f'admin{number}', password=hashed) for number in range(1, count + 1)), ignore_conflicts=True
+    )
+    AdminSession.objects.bulk_create(
+        (AdminSession(chat_id=str(chat_id)) for chat_id in range(1, sessions + 1)), ignore_conflicts=True
+    )
+
+
+class FakeRequest(BaseRequest):
+    """Bot API stand-in for benchmarks: answers every call locally and remembers the last keyboard per chat."""
+
+    def __init__(self):
+        self.calls = 0
+        self.keyboards = {}
+        self._message_ids = iter(range(1, 1 << 62))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == 'getMe':
+            result = {**BOT_USER, 'can_join_groups': False, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': False}
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            markup = params.get('reply_markup')
+            self.keyboards[chat_id] = markup if isinstance(markup, dict) else json.loads(markup) if markup else None
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER, 'text': params.get('text', '')}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class QueryCounter:
+    """execute_wrapper that counts queries per label of the calling context (contextvars follow sync_to_async)."""
+
+    label = contextvars.ContextVar('query_counter_label', default=None)
+
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        label = self.label.get()
+        if label is not None:
+            self.counts[label] = self.counts.get(label, 0) + 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        # Must run on the thread that owns the connection
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
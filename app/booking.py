@@ -0,0 +1,168 @@
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import events, stats
+from .availability import availability_index
+from .models import Court, Reservation, local_datetime
+
+# Serializes bookings made from threads of this process; lock_writes() does the same across processes
+_booking_lock = threading.Lock()
+BOOKING_LOCK_ID = 0x7E4415
+# What stats.record() needs to know about a reservation
+STATS_FIELDS = ('id', 'start_date', 'start_time', 'duration', 'confirmed')
+
+
+def lock_writes():
+    # Take the database write lock before reading, so concurrent bookings queue up instead of
+    # both passing the overlap check. Must run inside a transaction.
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [BOOKING_LOCK_ID])
+        elif connection.vendor == 'sqlite':
+            # Any write statement makes SQLite grab its single RESERVED lock for the transaction
+            cursor.execute(f'UPDATE {Reservation._meta.db_table} SET id = id WHERE 0')
+
+
+def book(start_date, start_time, duration, court_id=None, **fields):
+    # Create a reservation on `court_id`, or on the first active court that is free when it is None.
+    # Returns None when no such court is free for the whole interval.
+    start = local_datetime(start_date, start_time)
+    end = start + timedelta(minutes=duration)
+
+    with _booking_lock, transaction.atomic():
+        lock_writes()
+
+        # One query whatever the number of courts: the first court with nothing overlapping
+        courts = Court.objects.filter(is_active=True)
+        if court_id is not None:
+            courts = courts.filter(id=court_id)
+        busy = Reservation.objects.overlapping(start, end).values('court_id')
+        court = courts.exclude(id__in=busy).order_by('id').first()
+        if court is None:
+            return None
+
+        reservation = Reservation.objects.create(
+            court=court, start_date=start_date, start_time=start_time, duration=duration, **fields
+        )
+        stats.record([reservation])
+        events.publish(events.CREATED, [reservation], details=True)
+
+    availability_index.add(reservation.id, court.id, reservation.start_datetime, reservation.end_datetime)
+    return reservation
+
+
+def book_series(start_date, start_time, duration, weeks, court_id=None, **fields):
+    # Book the same time on `weeks` consecutive weeks, on `court_id` or on any active court. One query
+    # finds what is in the way of every occurrence and one INSERT creates the ones that are free, the
+    # rest are skipped. Returns (reservations, dates skipped); the reservations share a series_id, the
+    # id of the first of them.
+    dates = [start_date + timedelta(weeks=week) for week in range(weeks)]
+    spans = []
+    for date in dates:
+        start = local_datetime(date, start_time)
+        spans.append((start, start + timedelta(minutes=duration)))
+
+    with _booking_lock, transaction.atomic():
+        lock_writes()
+
+        courts = Court.objects.filter(is_active=True)
+        if court_id is not None:
+            courts = courts.filter(id=court_id)
+        courts = list(courts.order_by('id'))
+        overlapping = Q()
+        for start, end in spans:
+            overlapping |= Q(start_datetime__lt=end, end_datetime__gt=start)
+        busy = list(Reservation.objects.filter(overlapping).values_list('court_id', 'start_datetime', 'end_datetime'))
+
+        free = [
+            [court for court in courts if not any(
+                busy_court == court.id and busy_start < end and busy_end > start
+                for busy_court, busy_start, busy_end in busy
+            )]
+            for start, end in spans
+        ]
+        # The same court every week where possible, the one free on most of the dates
+        preferred = max(courts, key=lambda court: sum(court in options for options in free), default=None)
+
+        reservations, skipped = [], []
+        for date, options in zip(dates, free):
+            if not options:
+                skipped.append(date)
+                continue
+            reservation = Reservation(
+                court=preferred if preferred in options else options[0],
+                start_date=date, start_time=start_time, duration=duration, **fields
+            )
+            reservation.update_span()
+            reservations.append(reservation)
+        if not reservations:
+            return [], skipped
+
+        Reservation.objects.bulk_create(reservations)
+        series_id = reservations[0].id
+        Reservation.objects.filter(id__in=[reservation.id for reservation in reservations]).update(series_id=series_id)
+        for reservation in reservations:
+            reservation.series_id = series_id
+        stats.record(reservations)
+        events.publish_series(reservations)
+
+    for reservation in reservations:
+        availability_index.add(
+            reservation.id, reservation.court_id, reservation.start_datetime, reservation.end_datetime
+        )
+    return reservations, skipped
+
+
+def confirm_reservations(ids=(), dates=(), series=()):
+    # Confirm the given reservations and series plus every pending one on the given dates with a single
+    # UPDATE, returns the ids that matched
+    selection = Q(id__in=ids) | Q(series_id__in=series) | Q(start_date__in=dates, confirmed=False)
+    with transaction.atomic():
+        lock_writes()
+        found = list(Reservation.objects.filter(selection).order_by('id').only(*STATS_FIELDS))
+        Reservation.objects.filter(id__in=[reservation.id for reservation in found]).update(confirmed=True)
+
+        # Move the ones that were pending to the confirmed side of the rollup
+        pending = [reservation for reservation in found if not reservation.confirmed]
+        stats.record(pending, -1)
+        for reservation in pending:
+            reservation.confirmed = True
+        stats.record(pending)
+        events.publish(events.CONFIRMED, pending)
+    return [reservation.id for reservation in found]
+
+
+def cancel_reservations(ids=(), series=()):
+    # Delete the given reservations and series with a single DELETE, returns the ids that existed
+    with transaction.atomic():
+        lock_writes()
+        selection = Q(id__in=ids) | Q(series_id__in=series)
+        found = list(Reservation.objects.filter(selection).order_by('id').only(*STATS_FIELDS))
+        Reservation.objects.filter(id__in=[reservation.id for reservation in found]).delete()
+        stats.record(found, -1)
+        events.publish(events.CANCELLED, found)
+    for reservation in found:
+        availability_index.remove(reservation.id)
+    return [reservation.id for reservation in found]
+
+
+def expire_unpaid(hold_minutes):
+    # Delete upcoming reservations still unconfirmed `hold_minutes` after they were made, with a
+    # single DELETE, and return what was deleted so that admins and users can be told
+    now = timezone.now()
+    with transaction.atomic():
+        lock_writes()
+        stale = Reservation.objects.filter(
+            confirmed=False, created_at__lt=now - timedelta(minutes=hold_minutes), end_datetime__gt=now
+        )
+        expired = list(stale.select_related('court').order_by('start_datetime'))
+        Reservation.objects.filter(id__in=[reservation.id for reservation in expired]).delete()
+        stats.record(expired, -1)
+        events.publish(events.EXPIRED, expired, details=True)
+    for reservation in expired:
+        availability_index.remove(reservation.id)
+    return expired
@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import hmac
+from dataclasses import dataclass
+from datetime import date as Date
+
+from django.conf import settings
+
+# Telegram rejects buttons whose callback_data is longer than this many bytes
+MAX_LENGTH = 64
+SIGNATURE_BYTES = 6
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+class InvalidCallbackData(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Selection:
+    """What the user has picked so far in the booking conversation, carried by the buttons themselves."""
+
+    duration: int = None
+    court_id: int = None  # None means any free court
+    date: Date = None
+    time: int = None      # minutes from midnight
+    weeks: int = None     # number of weekly occurrences, 1 for a single booking
+
+
+def to_base36(number):
+    text = ''
+    while True:
+        number, digit = divmod(number, 36)
+        text = DIGITS[digit] + text
+        if not number:
+            return text
+
+
+def sign(payload):
+    key = hashlib.sha256(f'callback-data:{settings.SECRET_KEY}'.encode()).digest()
+    digest = hmac.new(key, payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def encode(step, selection=Selection()):
+    # "<step>:<duration>.<court>.<date ordinal>.<time>.<weeks>:<signature>", numbers in base 36 and empty
+    # when unset
+    fields = (
+        selection.duration, selection.court_id,
+        selection.date.toordinal() if selection.date else None, selection.time, selection.weeks,
+    )
+    payload = f"{step}:{'.'.join('' if value is None else to_base36(value) for value in fields)}"
+    data = f'{payload}:{sign(payload)}'
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError(f'Callback data longer than {MAX_LENGTH} bytes: {data}')
+    return data
+
+
+def decode(data):
+    # Returns (step, Selection), raises InvalidCallbackData for anything this server did not sign
+    payload, _, signature = data.rpartition(':')
+    if not hmac.compare_digest(signature.encode(), sign(payload).encode()):
+        raise InvalidCallbackData(f'Bad signature: {data}')
+    step, _, fields = payload.partition(':')
+    values = fields.split('.')
+    try:
+        duration, court_id, ordinal, time, weeks = (int(value, 36) if value else None for value in values)
+    except ValueError:
+        raise InvalidCallbackData(f'Malformed callback data: {data}')
+    return step, Selection(duration, court_id, Date.fromordinal(ordinal) if ordinal else None, time, weeks)
@@ -0,0 +1,51 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .instrumentation import record_db_call
+
+# Threads of this executor form the connection pool, each one holds a persistent connection
+_executor = ThreadPoolExecutor(max_workers=settings.DB_POOL_SIZE, thread_name_prefix='db') \
+    if settings.DB_POOL_SIZE > 1 else None
+
+
+def database_sync_to_async(func):
+    # sync_to_async for ORM code outside the request cycle: like a request, every call drops
+    # connections that are past CONN_MAX_AGE or broken, and reuses the rest
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    if _executor is None:
+        call = sync_to_async(inner)
+    else:
+        call = sync_to_async(inner, thread_sensitive=False, executor=_executor)
+
+    @functools.wraps(func)
+    async def timed(*args, **kwargs):
+        # Includes waiting for the database thread, which is what handlers actually pay
+        started = time.perf_counter()
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            record_db_call(time.perf_counter() - started)
+
+    return timed
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL lets readers carry on while another process writes; waiting for the write lock itself
+    # is bounded by the "timeout" database option (SQLite's busy timeout)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
@@ -0,0 +1,125 @@
+import asyncio
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .db import database_sync_to_async
+from .models import BookingEvent, EventCursor
+
+CREATED = 'created'
+SERIES_CREATED = 'series_created'
+CHANGED = 'changed'
+CONFIRMED = 'confirmed'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+
+
+def describe(reservation):
+    # What consumers need to know about a reservation without reading it back
+    return {
+        'court_id': reservation.court_id,
+        'court': reservation.court.name,
+        'date': reservation.start_date.isoformat(),
+        'time': reservation.start_time.strftime('%H:%M'),
+        'duration': reservation.duration,
+        'start': reservation.start_datetime.isoformat(),
+        'end': reservation.end_datetime.isoformat(),
+        'text': reservation.text,
+        'username': reservation.username,
+        'chat_id': reservation.chat_id,
+        'confirmed': reservation.confirmed,
+    }
+
+
+def publish(kind, reservations, details=False):
+    # Must run inside the transaction making the change, after lock_writes(): writers are serialized,
+    # so event ids become visible in order and a consumer never skips one
+    BookingEvent.objects.bulk_create(
+        BookingEvent(kind=kind, reservation_id=reservation.id, data=describe(reservation) if details else {})
+        for reservation in reservations
+    )
+
+
+def publish_series(reservations):
+    # A weekly series booked at once is one event listing every occurrence, so that admins hear
+    # about it in one message. Same rules as publish().
+    BookingEvent.objects.create(
+        kind=SERIES_CREATED, reservation_id=reservations[0].series_id,
+        data={'reservations': [{'id': reservation.id, **describe(reservation)} for reservation in reservations]},
+    )
+
+
+def latest_id():
+    return BookingEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def read(after_id, limit):
+    return list(BookingEvent.objects.filter(id__gt=after_id).order_by('id')[:limit])
+
+
+def load_cursor(consumer):
+    # A new consumer starts after the newest event instead of replaying the history
+    cursor, _ = EventCursor.objects.get_or_create(consumer=consumer, defaults={'last_id': latest_id()})
+    return cursor.last_id
+
+
+def save_cursor(consumer, last_id):
+    EventCursor.objects.filter(consumer=consumer).update(last_id=last_id)
+
+
+def purge(days):
+    # Delete events older than `days` that every durable consumer has handled, returns how many
+    with transaction.atomic():
+        handled = EventCursor.objects.aggregate(last_id=Min('last_id'))['last_id']
+        events = BookingEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=days))
+        if handled is not None:
+            events = events.filter(id__lte=handled)
+        deleted, _ = events.delete()
+    return deleted
+
+
+class EventRelay:
+    """Hands new outbox events to an async handler in id order, at least once.
+
+    The position only moves past a batch once the handler returned. Durable relays (with a consumer
+    name) keep it in EventCursor and resume from it after a restart; the others start after the newest
+    event, which suits caches that are reloaded on start anyway.
+    """
+
+    def __init__(self, handler, consumer=None, batch_size=100):
+        self.handler = handler
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.last_id = None
+
+    async def poll(self):
+        # Handle whatever is new, returns the number of events handled
+        if self.last_id is None:
+            self.last_id = await (a_load_cursor(self.consumer) if self.consumer else a_latest_id())
+        handled = 0
+        while events := await a_read(self.last_id, self.batch_size):
+            await self.handler(events)
+            self.last_id = events[-1].id
+            if self.consumer:
+                await a_save_cursor(self.consumer, self.last_id)
+            handled += len(events)
+            if len(events) < self.batch_size:
+                break
+        return handled
+
+    async def run(self, interval):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                # The batch is retried on the next poll
+                print(f"Error relaying booking events to {self.consumer or self.handler.__name__}: {e}")
+            await asyncio.sleep(interval)
+
+
+a_latest_id = database_sync_to_async(latest_id)
+a_read = database_sync_to_async(read)
+a_load_cursor = database_sync_to_async(load_cursor)
+a_save_cursor = database_sync_to_async(save_cursor)
@@ -0,0 +1,92 @@
+import csv
+import json
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import DURATION_TO_PRICE, Reservation
+
+# Rows fetched from the database at a time, memory use does not grow with the date range
+CHUNK_SIZE = 2000
+
+COLUMNS = (
+    'id', 'court', 'start_date', 'start_time', 'end_date', 'end_time', 'duration', 'price',
+    'confirmed', 'username', 'text', 'created_at',
+)
+
+
+def current_month():
+    # (first day, last day) of the current month, the default export range
+    today = timezone.localdate()
+    first = today.replace(day=1)
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    return first, next_month - timedelta(days=1)
+
+
+def export_queryset(date_from, date_to):
+    # Plain values instead of model instances, ordered along reservation_order_idx
+    return Reservation.objects.filter(start_date__range=(date_from, date_to)).order_by(
+        'start_date', 'start_time', 'id'
+    ).values(
+        'id', 'court__name', 'start_date', 'start_time', 'end_datetime', 'duration',
+        'confirmed', 'username', 'text', 'created_at',
+    )
+
+
+def export_row(values):
+    end = timezone.localtime(values['end_datetime'])
+    return {
+        'id': values['id'],
+        'court': values['court__name'],
+        'start_date': values['start_date'].isoformat(),
+        'start_time': values['start_time'].strftime('%H:%M'),
+        'end_date': end.date().isoformat(),
+        'end_time': end.strftime('%H:%M'),
+        'duration': values['duration'],
+        'price': DURATION_TO_PRICE.get(values['duration'], 0),
+        'confirmed': values['confirmed'],
+        'username': values['username'] or '',
+        'text': values['text'],
+        'created_at': timezone.localtime(values['created_at']).isoformat(timespec='seconds'),
+    }
+
+
+class Echo:
+    # File-like object for csv.writer that hands each formatted line back instead of storing it
+    def write(self, value):
+        return value
+
+
+csv_writer = csv.writer(Echo())
+
+
+def csv_line(row):
+    return csv_writer.writerow(row.values() if isinstance(row, dict) else row)
+
+
+def jsonl_line(row):
+    return json.dumps(row, ensure_ascii=False) + '\n'
+
+
+# format -> (header line or None, row formatter, content type, file extension)
+FORMATS = {
+    'csv': (csv_line(COLUMNS), csv_line, 'text/csv; charset=utf-8', 'csv'),
+    'jsonl': (None, jsonl_line, 'application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+
+def export_lines(date_from, date_to, format='csv'):
+    header, line, _, _ = FORMATS[format]
+    if header:
+        yield header
+    for values in export_queryset(date_from, date_to).iterator(chunk_size=CHUNK_SIZE):
+        yield line(export_row(values))
+
+
+async def aexport_lines(date_from, date_to, format='csv'):
+    # Same as export_lines() for ASGI servers, which would otherwise read a sync iterator into memory first
+    header, line, _, _ = FORMATS[format]
+    if header:
+        yield header
+    async for values in export_queryset(date_from, date_to).aiterator(chunk_size=CHUNK_SIZE):
+        yield line(export_row(values))
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import functools
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+from telegram.request import BaseRequest, HTTPXRequest
+
+# Upper bounds (seconds) of the handler latency histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Connection pool of the Bot API request object, python-telegram-bot's own default
+CONNECTION_POOL_SIZE = 256
+
+
+class Sample:
+    __slots__ = ('db_calls', 'db_seconds', 'queries', 'query_seconds', 'api_calls', 'api_seconds')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+# Sample of the handler call in progress, contextvars follow it into sync_to_async threads
+current_sample = contextvars.ContextVar('current_sample', default=None)
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.totals = Sample()
+
+    def add(self, seconds, sample, failed):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        for name in Sample.__slots__:
+            setattr(self.totals, name, getattr(self.totals, name) + getattr(sample, name))
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.handlers = {}  # (bot, handler) -> HandlerStats
+
+    def record(self, bot, handler, seconds, sample, failed=False):
+        with self._lock:
+            self.handlers.setdefault((bot, handler), HandlerStats()).add(seconds, sample, failed)
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    'bot': bot, 'handler': handler, 'calls': stats.calls, 'errors': stats.errors,
+                    'seconds': round(stats.seconds, 6), 'max_seconds': round(stats.max_seconds, 6),
+                    **{name: round(getattr(stats.totals, name), 6) for name in Sample.__slots__},
+                }
+                for (bot, handler), stats in sorted(self.handlers.items())
+            ]
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            items = sorted(self.handlers.items())
+        metrics = (
+            ('bot_handler_seconds', 'histogram', 'Wall time of bot handler calls.'),
+            ('bot_handler_errors_total', 'counter', 'Bot handler calls that raised.'),
+            ('bot_handler_db_calls_total', 'counter', 'database_sync_to_async calls made by bot handlers.'),
+            ('bot_handler_db_seconds_total', 'counter', 'Time bot handlers spent in database_sync_to_async calls.'),
+            ('bot_handler_queries_total', 'counter', 'SQL queries run by bot handlers.'),
+            ('bot_handler_query_seconds_total', 'counter', 'Time bot handlers spent executing SQL.'),
+            ('bot_handler_api_calls_total', 'counter', 'Bot API requests made by bot handlers.'),
+            ('bot_handler_api_seconds_total', 'counter', 'Time bot handlers spent in Bot API requests.'),
+        )
+        for name, kind, description in metrics:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (bot, handler), stats in items:
+                labels = f'bot="{bot}",handler="{handler}"'
+                if kind == 'histogram':
+                    for bound, count in zip(BUCKETS, stats.buckets):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {stats.calls}')
+                    lines.append(f'{name}_sum{{{labels}}} {stats.seconds}')
+                    lines.append(f'{name}_count{{{labels}}} {stats.calls}')
+                elif name == 'bot_handler_errors_total':
+                    lines.append(f'{name}{{{labels}}} {stats.errors}')
+                else:
+                    field = name[len('bot_handler_'):].removesuffix('_total')
+                    lines.append(f'{name}{{{labels}}} {getattr(stats.totals, field)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def count_query(execute, sql, params, many, context):
+    sample = current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.query_seconds += time.perf_counter() - started
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def record_db_call(seconds):
+    sample = current_sample.get()
+    if sample is not None:
+        sample.db_calls += 1
+        sample.db_seconds += seconds
+
+
+class InstrumentedRequest(BaseRequest):
+    """Wraps the bot's request object to time every Bot API call made by a handler."""
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def read_timeout(self):
+        return self.request.read_timeout
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self.request.do_request(*args, **kwargs)
+        finally:
+            sample = current_sample.get()
+            if sample is not None:
+                sample.api_calls += 1
+                sample.api_seconds += time.perf_counter() - started
+
+
+def instrument_builder(builder, request=None):
+    # Hand the builder a wrapped request object (by default the one it would have made itself), so that
+    # the Bot API calls of handlers are timed. getUpdates is left alone, it never runs inside a handler.
+    return builder.request(InstrumentedRequest(request or HTTPXRequest(connection_pool_size=CONNECTION_POOL_SIZE)))
+
+
+def instrument_callback(bot_name, callback):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        sample = Sample()
+        token = current_sample.set(sample)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await callback(update, context)
+            failed = False
+            return result
+        except ApplicationHandlerStop:
+            # Deliberately stops the other handlers, not an error
+            failed = False
+            raise
+        finally:
+            metrics.record(bot_name, callback.__name__, time.perf_counter() - started, sample, failed)
+            current_sample.reset(token)
+    return wrapper
+
+
+def iter_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from iter_handlers(state_handlers)
+            yield from iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+async def log_metrics(interval):
+    # Periodic structured log line for processes that have no /metrics endpoint (polling mode)
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps({'event': 'bot_metrics', 'handlers': metrics.snapshot()}), flush=True)
+
+
+def instrument_application(application, bot_name):
+    # Wrap every handler callback of the application, including those inside conversations
+    wrapped = set()
+    for group in application.handlers.values():
+        for handler in iter_handlers(group):
+            if id(handler) not in wrapped:
+                handler.callback = instrument_callback(bot_name, handler.callback)
+                wrapped.add(id(handler))
+
+    connection_created.connect(install_query_counter, dispatch_uid='install_query_counter')
+
+    if settings.METRICS_LOG_INTERVAL:
+        post_init, post_shutdown = application.post_init, application.post_shutdown
+        task = None
+
+        async def start_log(app):
+            nonlocal task
+            task = asyncio.create_task(log_metrics(settings.METRICS_LOG_INTERVAL))
+            if post_init:
+                await post_init(app)
+
+        async def stop_log(app):
+            if task:
+                task.cancel()
+            if post_shutdown:
+                await post_shutdown(app)
+
+        application.post_init, application.post_shutdown = start_log, stop_log
+    return application
@@ -0,0 +1,66 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from app.benchmarking import benchmark_database, format_ms, percentiles, seed_reservations
+from app.models import Reservation
+
+CHANGELIST = '/admin/app/reservation/'
+
+
+def changelist_pages(last_day):
+    # (label, query string) of the views admins actually open
+    month = last_day.replace(day=1)
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    week_ago = last_day - timedelta(days=6)
+    return (
+        ('default page', ''),
+        ('page 100', '?p=100'),
+        ('pending', '?confirmed__exact=0'),
+        ('one court', '?court__id__exact=2'),
+        ('last 7 days', f'?start_date__gte={week_ago}&start_date__lt={last_day + timedelta(days=1)}'),
+        ('one month', f'?start_date__gte={month}&start_date__lt={next_month}'),
+        ('search name', '?q=Коваленко'),
+        ('search phone', '?q=0500001'),
+        ('search + filter', '?q=Олена&confirmed__exact=1'),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Measure the Django admin reservation list on a seeded dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500_000, help='Reservations to seed')
+        parser.add_argument('--courts', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per page')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True), override_settings(ALLOWED_HOSTS=['*']):
+            started = time.perf_counter()
+            seed_reservations(options['rows'], options['courts'], options['seed'])
+            self.stdout.write(
+                f"Seeded {Reservation.objects.count()} reservations in {time.perf_counter() - started:.1f} s"
+            )
+            last_day = Reservation.objects.latest('start_date').start_date
+            user = get_user_model().objects.create_superuser('bench', 'bench@example.com', 'bench')
+            client = Client()
+            client.force_login(user)
+
+            self.stdout.write(f"Backend: {connection.vendor}, {options['repeat']} requests per page")
+            for label, query in changelist_pages(last_day):
+                samples = []
+                for _ in range(options['repeat']):
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = client.get(CHANGELIST + query)
+                        samples.append(time.perf_counter() - started)
+                    assert response.status_code == 200, (query, response.status_code)
+                p50 = percentiles(samples, (50,))['p50']
+                self.stdout.write(f'{label:>16}: p50 {format_ms(p50)}, {len(queries)} queries')
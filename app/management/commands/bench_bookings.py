@@ -0,0 +1,75 @@
+import multiprocessing
+import random
+import time
+from datetime import time as dt_time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+
+from app.benchmarking import benchmark_database, create_courts
+from app.booking import book
+
+ROLES = ('web', 'admin_bot', 'reservation_bot')
+
+
+def run_worker(role, seconds, days, seed, results):
+    # Child process: book random slots as fast as possible
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    counts = {'role': role, 'booked': 0, 'conflicts': 0, 'locked': 0}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        day = today + timedelta(days=rng.randrange(1, days + 1))
+        start = dt_time(rng.randrange(9, 22), rng.choice((0, 30)))
+        try:
+            reservation = book(day, start, rng.choice((60, 90, 120)), text=f'bench {role}', username=role)
+        except OperationalError:
+            counts['locked'] += 1
+        else:
+            counts['booked' if reservation else 'conflicts'] += 1
+    connection.close()
+    results.put(counts)
+
+
+class Command(BaseCommand):
+    help = 'Measure bookings/sec with several processes writing to the configured database at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=len(ROLES), help='Concurrent booking processes')
+        parser.add_argument('--seconds', type=float, default=10, help='How long every process keeps booking')
+        parser.add_argument('--days', type=int, default=365, help='Spread bookings over this many days ahead')
+        parser.add_argument('--courts', type=int, default=10, help='Bookable tables, bookings take the first free one')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # All processes share an on-disk throwaway copy of the schema
+        with benchmark_database(on_disk=True):
+            create_courts(options['courts'])
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            workers = [
+                context.Process(
+                    target=run_worker,
+                    args=(ROLES[i % len(ROLES)], options['seconds'], options['days'], options['seed'] + i, results),
+                )
+                for i in range(options['processes'])
+            ]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            counts = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"Backend: {connection.vendor}, {options['processes']} processes, {options['courts']} courts")
+        for count in counts:
+            self.stdout.write(
+                f"{count['role']:>16}: {count['booked']} booked, {count['conflicts']} conflicts, "
+                f"{count['locked']} lock timeouts"
+            )
+        booked = sum(count['booked'] for count in counts)
+        attempts = sum(count['booked'] + count['conflicts'] + count['locked'] for count in counts)
+        self.stdout.write(f'Bookings/sec: {booked / elapsed:.1f} ({attempts / elapsed:.1f} attempts/sec)')
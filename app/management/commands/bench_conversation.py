@@ -0,0 +1,173 @@
+import asyncio
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import BigIntegerField
+from django.db.models.functions import Coalesce
+from django.test import override_settings
+from telegram import Update
+from telegram.ext import Application
+
+from app.benchmarking import (
+    BOT_USER, FakeRequest, QueryCounter, benchmark_database, create_courts, format_ms, percentiles,
+)
+from app.db import database_sync_to_async
+from app.models import Reservation
+
+STEPS = ('start_reservation', 'select_court', 'select_date', 'select_time', 'collect_name_phone', 'confirm_reservation')
+
+
+class SimulatedUser:
+    def __init__(self, number, fake, rng):
+        self.chat_id = 500000 + number
+        self.user = {'id': self.chat_id, 'is_bot': False, 'first_name': 'Player', 'username': f'player{number}'}
+        self.fake = fake
+        self.rng = rng
+        self.message = {'message_id': 1, 'date': int(time.time()), 'from': BOT_USER,
+                        'chat': {'id': self.chat_id, 'type': 'private'}, 'text': '👋'}
+
+    def tap(self, update_id, data):
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self.user, 'chat_instance': str(self.chat_id),
+            'message': self.message, 'data': data,
+        }}
+
+    def type(self, update_id, text):
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'from': self.user,
+            'chat': {'id': self.chat_id, 'type': 'private'}, 'text': text,
+        }}
+
+    def choose(self):
+        # Pick one of the buttons the bot last showed this user, ignoring navigation
+        keyboard = self.fake.keyboards.get(self.chat_id)
+        buttons = [button['callback_data'] for row in (keyboard or {}).get('inline_keyboard', ())
+                   for button in row if not button['callback_data'].startswith('back_')]
+        return self.rng.choice(buttons) if buttons else None
+
+
+class Command(BaseCommand):
+    help = 'Drive the reservation conversation with simulated users and report latency, queries and throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Number of simulated users')
+        parser.add_argument('--concurrency', type=int, default=50, help='Users in the middle of a booking at once')
+        parser.add_argument('--courts', type=int, default=10, help='Bookable tables')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the results as a JSON baseline')
+        parser.add_argument('--compare', metavar='PATH', help='Compare the results with a saved baseline')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Fail when a p95 or the throughput is this much worse than the baseline')
+
+    def handle(self, *args, **options):
+        # Simulated users tap without pausing, the rate limits would turn most of their steps away
+        with override_settings(RESERVATION_BOT_TOKEN=settings.RESERVATION_BOT_TOKEN or '1:bench',
+                               RATE_LIMIT_PER_CHAT=0, BOT_GLOBAL_RATE=0):
+            import reservation_bot
+
+            fake = FakeRequest()
+            application = reservation_bot.build_application(Application.builder().updater(None), request=fake)
+
+        with benchmark_database():
+            results = asyncio.run(self.run(application, fake, options))
+
+        self.report(results)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(results, json.load(f), options['max_regression'])
+
+    async def run(self, application, fake, options):
+        rng = random.Random(options['seed'])
+        counter = QueryCounter()
+        latencies = {step: [] for step in STEPS}
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        update_ids = iter(range(1, 1 << 62))
+
+        await database_sync_to_async(counter.install)()
+        await database_sync_to_async(create_courts)(options['courts'])
+        # Started like run_polling() and the webhook router do, background tasks included
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        async def step(name, data):
+            QueryCounter.label.set(name)
+            update = Update.de_json(data, application.bot)
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies[name].append(time.perf_counter() - started)
+
+        async def simulate(number):
+            user = SimulatedUser(number, fake, random.Random(rng.random()))
+            async with semaphore:
+                await step('start_reservation', user.tap(next(update_ids), 'start_reservation'))
+                # The court step is skipped when there is only one court
+                for name in STEPS[1 if options['courts'] > 1 else 2:-1]:
+                    choice = user.choose()
+                    if choice is None:
+                        return  # Nothing left to pick, the bot ended the conversation
+                    await step(name, user.tap(next(update_ids), choice))
+                await step('confirm_reservation', user.type(next(update_ids), f'Player {number}, +38050{number:07d}'))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate(number) for number in range(options['users'])))
+        elapsed = time.perf_counter() - started
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+        # A weekly series is one booking made in one conversation, however many weeks it has
+        bookings = await database_sync_to_async(
+            Reservation.objects.values(booking=Coalesce('series_id', 'id', output_field=BigIntegerField())).distinct().count
+        )()
+        occurrences = await database_sync_to_async(Reservation.objects.count)()
+        return {
+            'users': options['users'],
+            'concurrency': options['concurrency'],
+            'courts': options['courts'],
+            'seconds': elapsed,
+            'bookings': bookings,
+            'occurrences': occurrences,
+            'bookings_per_sec': bookings / elapsed,
+            'api_calls': fake.calls,
+            'steps': {
+                name: {
+                    'calls': len(samples),
+                    **percentiles(samples),
+                    'queries_per_call': counter.counts.get(name, 0) / len(samples) if samples else 0,
+                }
+                for name, samples in latencies.items()
+            },
+        }
+
+    def report(self, results):
+        self.stdout.write(f"{results['users']} users, {results.get('courts', 1)} courts, {results['bookings']} bookings "
+                          f"({results.get('occurrences', results['bookings'])} reservations) in {results['seconds']:.2f} s "
+                          f"({results['bookings_per_sec']:.1f} bookings/s, {results['api_calls']} Bot API calls)")
+        self.stdout.write(f"{'step':<22}{'calls':>7}{'p50':>12}{'p95':>12}{'p99':>12}{'queries':>9}")
+        for name, step in results['steps'].items():
+            self.stdout.write(f"{name:<22}{step['calls']:>7}{format_ms(step['p50']):>12}{format_ms(step['p95']):>12}"
+                              f"{format_ms(step['p99']):>12}{step['queries_per_call']:>9.2f}")
+
+    def compare(self, results, baseline, max_regression):
+        regressions = []
+        for name, step in results['steps'].items():
+            before = baseline['steps'].get(name, {}).get('p95')
+            # Differences below a millisecond are scheduling noise
+            if before and step['p95'] > before * (1 + max_regression) and step['p95'] - before > 0.001:
+                regressions.append(f"{name} p95 {format_ms(before)} -> {format_ms(step['p95'])}")
+            self.stdout.write(f"{name:<22}p95 {format_ms(before or 0):>10} -> {format_ms(step['p95']):>10}")
+        if results['bookings_per_sec'] < baseline['bookings_per_sec'] * (1 - max_regression):
+            regressions.append(f"bookings/s {baseline['bookings_per_sec']:.1f} -> {results['bookings_per_sec']:.1f}")
+        if regressions:
+            raise CommandError('Regressions against the baseline: ' + '; '.join(regressions))
+        self.stdout.write('No regressions against the baseline.')
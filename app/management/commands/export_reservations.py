@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from app.exports import FORMATS, current_month, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream the reservations starting in a date range as CSV or JSON lines, with price and end time.'
+
+    def add_arguments(self, parser):
+        first, last = current_month()
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, default=first,
+                            help='First start date, YYYY-MM-DD (default: first day of this month)')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, default=last,
+                            help='Last start date, YYYY-MM-DD (default: last day of this month)')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', metavar='PATH', help='Write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['date_from'], options['date_to'], options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
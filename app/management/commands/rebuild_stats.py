@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from app.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the DailyStats rollup from the reservations, for a date range or everything.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='First date, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='Last date, YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        rows = rebuild(options['date_from'], options['date_to'])
+        self.stdout.write(f'Wrote {rows} rollup rows.')
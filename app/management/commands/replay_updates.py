@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from telegram.ext import Application
+
+from app.benchmarking import format_ms, percentiles
+from app.callback_data import Selection, encode
+from app.webhooks import TelegramWebhookRouter, respond, webhook_path
+
+
+def synthetic_update(update_id):
+    # Duration button tap, the most common update the reservation bot receives
+    user = {'id': 100000 + update_id % 500, 'is_bot': False, 'first_name': 'Player'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(user['id']),
+            'data': encode('duration', Selection(duration=60)),
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user['id'], 'type': 'private'},
+                'text': '⏳ Оберіть тривалість:',
+            },
+        },
+    }
+
+
+async def not_found(scope, receive, send):
+    await respond(send, 404)
+
+
+class Command(BaseCommand):
+    help = 'Replay Telegram update JSON through the webhook ASGI router and measure its throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='JSON lines file with recorded updates, synthetic ones are used if omitted')
+        parser.add_argument('--count', type=int, default=10000, help='Number of updates to send')
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            with open(options['file']) as f:
+                recorded = [json.loads(line) for line in f if line.strip()]
+        else:
+            recorded = [synthetic_update(i) for i in range(1000)]
+        payloads = [json.dumps(recorded[i % len(recorded)]).encode() for i in range(options['count'])]
+
+        # Bots are never initialized, so any token will do when none is configured
+        with override_settings(
+            RESERVATION_BOT_TOKEN=settings.RESERVATION_BOT_TOKEN or '1:replay',
+            ADMIN_BOT_TOKEN=settings.ADMIN_BOT_TOKEN or '2:replay',
+            # Measures the router, not the reservation bot's rate limits
+            RATE_LIMIT_PER_CHAT=0, DUPLICATE_TAP_WINDOW=0, BOT_GLOBAL_RATE=0,
+        ):
+            import admin_bot
+            import reservation_bot
+
+            applications = [
+                reservation_bot.build_application(Application.builder().updater(None)),
+                admin_bot.build_application(Application.builder().updater(None)),
+            ]
+        asyncio.run(self.replay(applications, payloads, options['concurrency']))
+
+    async def replay(self, applications, payloads, concurrency):
+        secret = 'replay-secret'
+        router = TelegramWebhookRouter(not_found, applications, secret_token=secret)
+        paths = [webhook_path(application.bot.token) for application in applications]
+        headers = [(b'x-telegram-bot-api-secret-token', secret.encode())]
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        statuses = {}
+        queued = 0
+
+        async def drain(application):
+            nonlocal queued
+            while True:
+                await application.update_queue.get()
+                queued += 1
+
+        async def post(i, payload):
+            scope = {'type': 'http', 'method': 'POST', 'path': paths[i % len(paths)], 'headers': headers}
+            messages = [{'type': 'http.request', 'body': payload, 'more_body': False}]
+            status = None
+
+            async def receive():
+                return messages.pop()
+
+            async def send(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+
+            async with semaphore:
+                started = time.perf_counter()
+                await router(scope, receive, send)
+                latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        drainers = [asyncio.create_task(drain(application)) for application in applications]
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i, payload) for i, payload in enumerate(payloads)))
+        while queued < statuses.get(200, 0):
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+        for drainer in drainers:
+            drainer.cancel()
+
+        self.stdout.write(f'Updates: {len(payloads)} in {elapsed:.2f} s ({len(payloads) / elapsed:.0f} updates/s)')
+        self.stdout.write(f'Responses: {dict(sorted(statuses.items()))}')
+        for name, value in percentiles(latencies).items():
+            self.stdout.write(f'{name}: {format_ms(value)}')
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from app.benchmarking import seed_admins, seed_reservations
+from app.models import DailyStats, Reservation
+
+# Seeded bookings end this many days ahead, like the booking horizon of reservation_bot.py
+DAYS_AHEAD = 14
+
+
+class Command(BaseCommand):
+    help = 'Fill the configured database with reproducible synthetic reservations, admins and admin sessions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservations', type=int, default=1_000_000)
+        parser.add_argument('--courts', type=int, default=10, help='Tables to spread the reservations over')
+        parser.add_argument('--admins', type=int, default=20)
+        parser.add_argument('--sessions', type=int, default=10, help='Logged in admin chats')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed, same rows')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per INSERT')
+        parser.add_argument('--replace', action='store_true', help='Delete existing reservations first')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        with transaction.atomic():
+            if Reservation.objects.exists():
+                if not options['replace']:
+                    raise CommandError('There are reservations already, pass --replace to delete them.')
+                Reservation.objects.all().delete()
+                DailyStats.objects.all().delete()
+            seed_reservations(
+                options['reservations'], options['courts'], options['seed'],
+                timezone.localdate() + timedelta(days=DAYS_AHEAD), options['batch_size'],
+            )
+            seed_admins(options['admins'], options['sessions'])
+        self.stdout.write(
+            f"Seeded {options['reservations']} reservations on {options['courts']} courts, "
+            f"{options['admins']} admins and {options['sessions']} sessions in {time.perf_counter() - started:.1f} s."
+        )
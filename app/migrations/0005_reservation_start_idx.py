@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_remove_reservation_name_remove_reservation_phone_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['start_date', 'start_time'], name='reservation_start_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+
+def backfill_span(apps, schema_editor):
+    Reservation = apps.get_model('app', 'Reservation')
+    reservations = Reservation.objects.only('start_date', 'start_time', 'duration').order_by('pk')
+    batch = []
+    for reservation in reservations.iterator(chunk_size=BATCH_SIZE):
+        reservation.start_datetime = timezone.make_aware(
+            datetime.combine(reservation.start_date, reservation.start_time)
+        )
+        reservation.end_datetime = reservation.start_datetime + timedelta(minutes=reservation.duration)
+        batch.append(reservation)
+        if len(batch) == BATCH_SIZE:
+            Reservation.objects.bulk_update(batch, ['start_datetime', 'end_datetime'])
+            batch = []
+    if batch:
+        Reservation.objects.bulk_update(batch, ['start_datetime', 'end_datetime'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_reservation_start_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='start_datetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='end_datetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_span, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reservation',
+            name='start_datetime',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='end_datetime',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['start_datetime', 'end_datetime'], name='reservation_span_idx'),
+        ),
+    ]
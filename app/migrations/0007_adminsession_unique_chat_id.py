@@ -0,0 +1,24 @@
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_sessions(apps, schema_editor):
+    AdminSession = apps.get_model('app', 'AdminSession')
+    keep = AdminSession.objects.values('chat_id').annotate(first_id=Min('id')).values('first_id')
+    AdminSession.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_reservation_span'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='adminsession',
+            name='chat_id',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_adminsession_unique_chat_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='chat_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['confirmed', 'created_at'], name='reservation_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_default_court(apps, schema_editor):
+    # Everything booked so far was on the venue's only table
+    Court = apps.get_model('app', 'Court')
+    Reservation = apps.get_model('app', 'Reservation')
+    court, _ = Court.objects.get_or_create(name='Стіл 1')
+    Reservation.objects.filter(court__isnull=True).update(court=court)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_reservation_chat_id_pending_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Court',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='court',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='app.court'),
+        ),
+        migrations.RunPython(create_default_court, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reservation',
+            name='court',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='app.court'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_court'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bot', models.CharField(max_length=64)),
+                ('kind', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=255)),
+                ('data', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='botstate',
+            constraint=models.UniqueConstraint(fields=('bot', 'kind', 'key'), name='bot_state_unique_key'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:44
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import ExtractHour
+
+# Prices at the time of this migration
+DURATION_TO_PRICE = {60: 300, 90: 450, 120: 550, 180: 750}
+
+
+def fill_stats(apps, schema_editor):
+    Reservation = apps.get_model('app', 'Reservation')
+    DailyStats = apps.get_model('app', 'DailyStats')
+    price = Case(
+        *(When(duration=duration, then=Value(price)) for duration, price in DURATION_TO_PRICE.items()),
+        default=Value(0), output_field=IntegerField(),
+    )
+    rows = Reservation.objects.annotate(date=F('start_date'), hour=ExtractHour('start_time')).values(
+        'date', 'hour', 'duration', 'confirmed'
+    ).annotate(count=Count('id'), minutes=Sum('duration'), revenue=Sum(price)).order_by()
+    DailyStats.objects.bulk_create(DailyStats(**row) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_botstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('duration', models.PositiveIntegerField()),
+                ('confirmed', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('minutes', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailystats',
+            constraint=models.UniqueConstraint(fields=('date', 'hour', 'duration', 'confirmed'), name='daily_stats_unique_key'),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
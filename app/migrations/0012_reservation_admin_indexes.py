@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_dailystats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reservation',
+            name='reservation_start_idx',
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='court',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='app.court'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['start_date', 'start_time', 'id'], name='reservation_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['court', 'start_date', 'start_time'], name='reservation_court_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['created_at'], name='reservation_created_idx'),
+        ),
+    ]
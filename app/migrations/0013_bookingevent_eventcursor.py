@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_reservation_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('reservation_id', models.BigIntegerField()),
+                ('data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=64, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_bookingevent_eventcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adminsession',
+            name='admin',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='app.admin'),
+        ),
+        migrations.AddField(
+            model_name='adminsession',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='adminsession',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='adminsession',
+            name='user_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
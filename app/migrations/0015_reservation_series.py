@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_adminsession_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='series_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['series_id'], name='reservation_series_idx'),
+        ),
+    ]
@@ -1,5 +1,17 @@
+from datetime import datetime, timedelta
+
 from django.db import models
 from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+
+# Duration to price mapping
+DURATION_TO_PRICE = {
+    60: 300,   # 1 hour
+    90: 450,   # 1.5 hours
+    120: 550,  # 2 hours
+    180: 750   # 3 hours
+}
 
 
 class Admin(models.Model):
@@ -14,14 +26,137 @@ class Admin(models.Model):
 
 
 class AdminSession(models.Model):
-    chat_id = models.CharField(max_length=255)
+    # A logged-in admin chat: receives booking notifications and, until the session expires, lets the
+    # Telegram user who logged in run admin commands there, see app/admin_sessions.py. Nothing secret is
+    # kept: Telegram vouches for the user id of every update.
+    chat_id = models.CharField(max_length=255, unique=True)
+    admin = models.ForeignKey(Admin, on_delete=models.CASCADE, null=True, blank=True, related_name='sessions')
+    user_id = models.BigIntegerField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+
+class BotState(models.Model):
+    # python-telegram-bot user_data, chat_data and conversation states, see app/persistence.py
+    bot = models.CharField(max_length=64)
+    kind = models.CharField(max_length=64)  # 'user_data', 'chat_data', 'bot_data' or 'conversation:<name>'
+    key = models.CharField(max_length=255)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bot', 'kind', 'key'], name='bot_state_unique_key'),
+        ]
+
+
+class Court(models.Model):
+    # A bookable table; reservations never share a court at the same time
+    name = models.CharField(max_length=255, unique=True)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.name
+
+
+def local_datetime(date, time):
+    # Aware datetime for a wall-clock date and time in the project time zone
+    return timezone.make_aware(datetime.combine(date, time))
+
+
+class ReservationQuerySet(models.QuerySet):
+    def overlapping(self, start, end):
+        # Reservations sharing any part of the half-open interval [start, end)
+        return self.filter(start_datetime__lt=end, end_datetime__gt=start)
+
+    def for_range(self, date_from, date_to):
+        # Reservations occupying any time between the start of date_from and the end of date_to,
+        # including ones that started the evening before and run past midnight
+        return self.overlapping(
+            local_datetime(date_from, datetime.min.time()),
+            local_datetime(date_to + timedelta(days=1), datetime.min.time()),
+        )
 
 
 class Reservation(models.Model):
+    # Indexed by reservation_court_idx below
+    court = models.ForeignKey(Court, on_delete=models.PROTECT, related_name='reservations', db_index=False)
     start_date = models.DateField()
     start_time = models.TimeField()
     duration = models.PositiveIntegerField()
+    # Denormalized from start_date, start_time and duration so interval checks run in SQL
+    start_datetime = models.DateTimeField(editable=False)
+    end_datetime = models.DateTimeField(editable=False)
     text = models.TextField()
     username = models.CharField(max_length=255, blank=True, null=True)
+    # Telegram chat of the user who booked through the bot
+    chat_id = models.BigIntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     confirmed = models.BooleanField(default=False)
+    # Id of the first reservation of a weekly series booked at once, see booking.book_series()
+    series_id = models.BigIntegerField(blank=True, null=True, editable=False)
+
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Default admin ordering (newest first, id as tie breaker) and exports
+            models.Index(fields=['start_date', 'start_time', 'id'], name='reservation_order_idx'),
+            models.Index(fields=['court', 'start_date', 'start_time'], name='reservation_court_idx'),
+            models.Index(fields=['created_at'], name='reservation_created_idx'),
+            models.Index(fields=['start_datetime', 'end_datetime'], name='reservation_span_idx'),
+            models.Index(fields=['confirmed', 'created_at'], name='reservation_pending_idx'),
+            models.Index(fields=['series_id'], name='reservation_series_idx'),
+        ]
+
+    @property
+    def price(self):
+        return DURATION_TO_PRICE.get(self.duration, 0)
+
+    def update_span(self):
+        self.start_datetime = local_datetime(self.start_date, self.start_time)
+        self.end_datetime = self.start_datetime + timedelta(minutes=self.duration)
+
+    def save(self, *args, **kwargs):
+        # Keep the stored interval in sync with the fields it is derived from
+        self.update_span()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'start_date', 'start_time', 'duration'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'start_datetime', 'end_datetime'}
+        super().save(*args, **kwargs)
+
+
+class DailyStats(models.Model):
+    # Reservations rolled up by start date, start hour, duration and status, kept up to date by
+    # app/booking.py and rebuilt from scratch by the rebuild_stats command
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    duration = models.PositiveIntegerField()
+    confirmed = models.BooleanField()
+    count = models.IntegerField(default=0)
+    minutes = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'hour', 'duration', 'confirmed'], name='daily_stats_unique_key'),
+        ]
+
+
+class BookingEvent(models.Model):
+    # Transactional outbox: written in the same transaction as the reservation change it describes,
+    # read in id order by every bot process, see app/events.py
+    # 'created', 'series_created', 'changed', 'confirmed', 'cancelled' or 'expired'
+    kind = models.CharField(max_length=16)
+    reservation_id = models.BigIntegerField()  # the series_id for 'series_created'
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class EventCursor(models.Model):
+    # Id of the last BookingEvent a durable consumer has handled
+    consumer = models.CharField(max_length=64, unique=True)
+    last_id = models.BigIntegerField(default=0)
@@ -0,0 +1,98 @@
+import asyncio
+from dataclasses import dataclass
+
+import httpx
+from django.conf import settings
+
+
+@dataclass
+class DeliveryResult:
+    chat_id: str
+    ok: bool
+    status: int = None
+    attempts: int = 0
+    error: str = None
+    retryable: bool = False  # failed for a reason that may pass (network, 5xx, rate limit)
+
+
+def response_json(response):
+    # Bot API answers are JSON objects, but a proxy or gateway in between may answer an error with HTML
+    try:
+        data = response.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class TelegramNotifier:
+    """Concurrent sendMessage fan-out over one pooled keep-alive HTTP client."""
+
+    def __init__(self, token, api_url=None, concurrency=None, retries=None, backoff=0.5, timeout=10, transport=None):
+        self.token = token
+        self.api_url = api_url or settings.TELEGRAM_API_URL
+        self.concurrency = concurrency or settings.NOTIFY_CONCURRENCY
+        self.retries = settings.NOTIFY_RETRIES if retries is None else retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.transport = transport
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so that it binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=f"{self.api_url}/bot{self.token}",
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                timeout=self.timeout,
+                transport=self.transport,
+            )
+        return self._client
+
+    async def send_message(self, chat_ids, text, reply_markup=None):
+        return await self.send_messages([(chat_id, text, reply_markup) for chat_id in chat_ids])
+
+    async def send_messages(self, messages):
+        # Deliver (chat_id, text, reply_markup) triples, at most `concurrency` at a time
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(chat_id, text, reply_markup):
+            payload = {"text": text}
+            if reply_markup is not None:
+                payload["reply_markup"] = reply_markup.to_dict()
+            async with semaphore:
+                return await self._deliver(chat_id, payload)
+
+        return await asyncio.gather(*(deliver(*message) for message in messages))
+
+    async def _deliver(self, chat_id, payload):
+        result = DeliveryResult(chat_id=chat_id, ok=False)
+        while result.attempts <= self.retries:
+            result.attempts += 1
+            delay = self.backoff * 2 ** (result.attempts - 1)
+            try:
+                response = await self.client.post("/sendMessage", json={"chat_id": chat_id, **payload})
+            except httpx.TransportError as e:
+                result.error = str(e)
+            else:
+                result.status = response.status_code
+                if response.status_code == 429:
+                    # Telegram says exactly how long to wait
+                    result.error = "Too Many Requests"
+                    delay = response_json(response).get("parameters", {}).get("retry_after", delay)
+                elif response.status_code >= 500:
+                    result.error = response.reason_phrase
+                else:
+                    result.ok = response.status_code == 200
+                    result.error = None if result.ok else response_json(response).get("description", response.reason_phrase)
+                    return result
+
+            if result.attempts <= self.retries:
+                await asyncio.sleep(delay)
+        result.retryable = True
+        return result
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
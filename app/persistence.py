@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+from django.db import transaction
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .db import database_sync_to_async
+from .models import BotState
+
+USER_DATA = 'user_data'
+CHAT_DATA = 'chat_data'
+BOT_DATA = 'bot_data'
+
+
+def conversation_kind(name):
+    return f'conversation:{name}'
+
+
+class DatabasePersistence(BasePersistence):
+    """python-telegram-bot persistence in the BotState table, so that a bot's state survives restarts.
+
+    The state is read once, when the Application starts, and never refreshed: processes serving the
+    same bot at once do not see each other's changes. The Application hands over what changed every
+    `update_interval` seconds; those changes are buffered and written in one transaction right after,
+    instead of once per update.
+    """
+
+    # Failed writes of a batch are retried with the next run this many times, then given up on
+    FLUSH_ATTEMPTS = 3
+
+    def __init__(self, bot_name, update_interval=60,
+                 store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False)):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.bot_name = bot_name
+        self._pending = {}  # (kind, key) -> JSON data, None to delete the row
+        self._flush_task = None
+        self._failed_flushes = 0
+
+    def _load(self, kind):
+        return {row.key: row.data for row in BotState.objects.filter(bot=self.bot_name, kind=kind)}
+
+    def _write(self, changes):
+        upserts = [
+            BotState(bot=self.bot_name, kind=kind, key=key, data=data)
+            for (kind, key), data in changes.items() if data is not None
+        ]
+        deletes = {}
+        for (kind, key), data in changes.items():
+            if data is None:
+                deletes.setdefault(kind, []).append(key)
+        with transaction.atomic():
+            BotState.objects.bulk_create(
+                upserts, update_conflicts=True, unique_fields=['bot', 'kind', 'key'], update_fields=['data', 'updated_at']
+            )
+            for kind, keys in deletes.items():
+                BotState.objects.filter(bot=self.bot_name, kind=kind, key__in=keys).delete()
+
+    async def _load_async(self, kind):
+        return await database_sync_to_async(self._load)(kind)
+
+    def _mark(self, kind, key, data):
+        # Encoded right away on the event loop: the copy is what gets written, even if handlers change
+        # the live dict before the database thread gets to it, and a value JSON cannot hold is
+        # reported here instead of failing the whole batch
+        if data is not None:
+            try:
+                data = json.loads(json.dumps(data))
+            except (TypeError, ValueError) as e:
+                print(f"Error saving {self.bot_name} {kind} {key}, not JSON serializable: {e}")
+                return
+        self._pending[(kind, str(key))] = data
+        # The Application gathers all update_* calls of a run at once: by the time this task runs,
+        # the whole run is buffered and goes to the database as one batch
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self):
+        await asyncio.sleep(0)
+        self._flush_task = None
+        changes, self._pending = self._pending, {}
+        if changes:
+            try:
+                await database_sync_to_async(self._write)(changes)
+            except Exception as e:
+                self._failed_flushes += 1
+                if self._failed_flushes >= self.FLUSH_ATTEMPTS:
+                    print(f"Error saving {self.bot_name} state, giving up on {len(changes)} changes: {e}")
+                    self._failed_flushes = 0
+                    return
+                print(f"Error saving {self.bot_name} state: {e}")
+                # Retried with the next run, newer changes win
+                self._pending = {**changes, **self._pending}
+            else:
+                self._failed_flushes = 0
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._load_async(USER_DATA)).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._load_async(CHAT_DATA)).items()}
+
+    async def get_bot_data(self):
+        return (await self._load_async(BOT_DATA)).get('', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await self._load_async(conversation_kind(name))
+        return {tuple(json.loads(key)): state for key, state in rows.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(conversation_kind(name), json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._mark(USER_DATA, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark(CHAT_DATA, chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._mark(BOT_DATA, '', data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._mark(USER_DATA, user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark(CHAT_DATA, chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Called once more when the application stops
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from telegram.ext import ApplicationHandlerStop
+
+
+class TokenBucket:
+    """`rate` tokens a second, up to `capacity` of them saved up."""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        # Take a token if there is one
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def reserve(self, now):
+        # Take a token even if it still has to be earned, returns the seconds until it is
+        self.refill(now)
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class ChatState:
+    __slots__ = ('bucket', 'last_data', 'last_seen')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.last_data = None
+        self.last_seen = None
+
+
+class UpdateThrottle:
+    """Per-chat debouncing and rate limiting of incoming updates, run before every other handler.
+
+    A callback query repeating the chat's previous one less than `duplicate_window` seconds after it is
+    answered and dropped, and so is any update beyond the chat's token bucket (`rate` a second, bursts of
+    `burst`). Neither reaches the database nor edits a message. Updates that get through then wait for the
+    bot-wide `global_rate` bucket, which paces the messages and edits they cause. Zero disables a limit.
+    """
+
+    # Chats idle this long are forgotten once more than `max_chats` are tracked
+    IDLE_SECONDS = 60
+
+    def __init__(self, rate, burst, duplicate_window, global_rate=0, busy_text=None, clock=time.monotonic,
+                 max_chats=10000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.duplicate_window = duplicate_window
+        self.busy_text = busy_text
+        self.clock = clock
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1), clock()) if global_rate else None
+        self.chats = {}
+        self.coalesced = 0
+        self.limited = 0
+
+    def chat_state(self, chat_id, now):
+        state = self.chats.get(chat_id)
+        if state is None:
+            if len(self.chats) >= self.max_chats:
+                self.forget_idle(now)
+            state = self.chats[chat_id] = ChatState(TokenBucket(self.rate, self.burst, now) if self.rate else None)
+        return state
+
+    def forget_idle(self, now):
+        self.chats = {
+            chat_id: state for chat_id, state in self.chats.items() if now - state.last_seen < self.IDLE_SECONDS
+        }
+
+    async def throttle(self, update, context):
+        chat = update.effective_chat
+        if chat is None:
+            return
+        now = self.clock()
+        state = self.chat_state(chat.id, now)
+        query = update.callback_query
+
+        # The window slides with every tap, so a continuous barrage of one button collapses into its first tap
+        repeated = query is not None and query.data == state.last_data and now - state.last_seen < self.duplicate_window
+        state.last_data = query.data if query is not None else None
+        state.last_seen = now
+        if repeated:
+            self.coalesced += 1
+            await query.answer()
+            raise ApplicationHandlerStop
+
+        if state.bucket is not None and not state.bucket.take(now):
+            self.limited += 1
+            if query is not None:
+                await query.answer(self.busy_text)
+            raise ApplicationHandlerStop
+
+        if self.global_bucket is not None:
+            delay = self.global_bucket.reserve(now)
+            if delay:
+                await asyncio.sleep(delay)
@@ -0,0 +1,71 @@
+from . import booking, events, stats
+from .admin_sessions import admin_registry, verify_password
+from .availability import availability_index, refresh_courts, refresh_range
+from .db import database_sync_to_async
+from .models import Admin
+
+# Everything the bots read from or write to the database. Every function is one unit of work and
+# costs at most one hop to the database threads of app/db.py, the ones answered from the in-memory
+# caches none. Django's own async methods (aget(), acreate(), ...) are avoided on purpose: in
+# Django 5.0 each of them is a separate sync_to_async() call on one shared thread.
+
+
+# Reservation bot
+
+load_courts = database_sync_to_async(refresh_courts)
+load_availability = database_sync_to_async(refresh_range)
+book = database_sync_to_async(booking.book)
+book_series = database_sync_to_async(booking.book_series)
+
+
+async def get_courts():
+    if not availability_index.courts_fresh():
+        await load_courts()
+    return availability_index.courts
+
+
+async def ensure_availability(dates):
+    # One query reloads all the dates whose index entries have expired, none when they are all fresh
+    stale = [date for date in dates if not availability_index.is_fresh(date)]
+    if stale:
+        await load_availability(stale[0], stale[-1])
+
+
+@database_sync_to_async
+def sweep_unpaid(hold_minutes, retention_days):
+    # Release unpaid reservations and drop old booking events, returns the released reservations
+    expired = booking.expire_unpaid(hold_minutes)
+    events.purge(retention_days)
+    return expired
+
+
+# Admin bot
+
+@database_sync_to_async
+def login(username, password, chat_id, user_id):
+    # Check the credentials and, when they match, start the user's admin session in the chat
+    admin = Admin.objects.filter(username=username).only('password').first()
+    if admin is None or not verify_password(admin, password):
+        return False
+    admin_registry.login(chat_id, user_id, admin)
+    return True
+
+
+logout = database_sync_to_async(admin_registry.logout)
+load_admin_sessions = database_sync_to_async(admin_registry.load)
+confirm_reservations = database_sync_to_async(booking.confirm_reservations)
+cancel_reservations = database_sync_to_async(booking.cancel_reservations)
+period_stats = database_sync_to_async(stats.period_stats)
+
+
+async def admin_chat_ids():
+    # Served from memory, the database is only read once the cache has expired
+    if not admin_registry.is_fresh():
+        await load_admin_sessions()
+    return admin_registry.chat_ids()
+
+
+async def is_admin(chat_id, user_id):
+    if not admin_registry.is_fresh():
+        await load_admin_sessions()
+    return admin_registry.is_authorized(chat_id, user_id)
@@ -0,0 +1,67 @@
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+# SQLite: FTS5 index over Reservation.username and text, its trigram tokenizer matches any substring
+# of 3+ characters case-insensitively (Cyrillic included), like icontains without the table scan
+SEARCH_TABLE = 'app_reservation_search'
+SQLITE_OBJECTS = (
+    (SEARCH_TABLE, f"""
+        CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+            username, text, content='app_reservation', content_rowid='id', tokenize='trigram'
+        )"""),
+    (f'{SEARCH_TABLE}_insert', f"""
+        CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON app_reservation BEGIN
+            INSERT INTO {SEARCH_TABLE}(rowid, username, text) VALUES (new.id, new.username, new.text);
+        END"""),
+    (f'{SEARCH_TABLE}_delete', f"""
+        CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON app_reservation BEGIN
+            INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, username, text)
+            VALUES ('delete', old.id, old.username, old.text);
+        END"""),
+    (f'{SEARCH_TABLE}_update', f"""
+        CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF username, text ON app_reservation BEGIN
+            INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, username, text)
+            VALUES ('delete', old.id, old.username, old.text);
+            INSERT INTO {SEARCH_TABLE}(rowid, username, text) VALUES (new.id, new.username, new.text);
+        END"""),
+)
+
+# PostgreSQL: trigram GIN indexes on the exact expressions Django's icontains compiles to
+POSTGRESQL_SQL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS reservation_username_trgm_idx ON app_reservation '
+    'USING gin (UPPER("username"::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS reservation_text_trgm_idx ON app_reservation '
+    'USING gin (UPPER("text"::text) gin_trgm_ops)',
+)
+
+# Shorter terms cannot be matched by trigrams
+MIN_TERM_LENGTH = 3
+
+
+def install_search_index(sender, using='default', **kwargs):
+    # post_migrate handler. SQLite drops triggers whenever a migration rebuilds app_reservation,
+    # so whatever is missing is recreated after every migrate, and the index rebuilt if it was.
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE %s", [f'{SEARCH_TABLE}%'])
+            existing = {name for (name,) in cursor.fetchall()}
+            missing = [sql for name, sql in SQLITE_OBJECTS if name not in existing]
+            for sql in missing:
+                cursor.execute(sql)
+            if missing:
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            for sql in POSTGRESQL_SQL:
+                cursor.execute(sql)
+
+
+def matching_ids(search_term, connection):
+    # Subquery of the ids of reservations containing every term of `search_term`, or None when
+    # the backend has no full-text index for it and icontains has to do
+    terms = search_term.split()
+    if connection.vendor != 'sqlite' or not terms or min(map(len, terms)) < MIN_TERM_LENGTH:
+        return None
+    query = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    return RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [query])
@@ -0,0 +1,103 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .availability import CLOSING_TIME, OPENING_TIME
+from .models import DURATION_TO_PRICE, Court, DailyStats, Reservation
+
+KEY_FIELDS = ('date', 'hour', 'duration', 'confirmed')
+PERIODS = ('day', 'week', 'month')
+
+
+def price_expression():
+    # DURATION_TO_PRICE as SQL, for aggregating revenue in the database
+    return Case(
+        *(When(duration=duration, then=Value(price)) for duration, price in DURATION_TO_PRICE.items()),
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def aggregate(reservations):
+    # Rollup rows (dicts of KEY_FIELDS plus count, minutes and revenue) computed by the database
+    return reservations.annotate(date=F('start_date'), hour=ExtractHour('start_time')).values(
+        *KEY_FIELDS
+    ).annotate(
+        count=Count('id'), minutes=Sum('duration'), revenue=Sum(price_expression()),
+    ).order_by()
+
+
+def record(reservations, sign=1):
+    # Add (sign=1) or remove (sign=-1) reservations from the rollup; called inside the transaction that
+    # creates, confirms or deletes them so that both always agree
+    deltas = Counter()
+    for reservation in reservations:
+        deltas[(reservation.start_date, reservation.start_time.hour, reservation.duration, reservation.confirmed)] += sign
+    for (date, hour, duration, confirmed), count in deltas.items():
+        key = {'date': date, 'hour': hour, 'duration': duration, 'confirmed': confirmed}
+        minutes, revenue = count * duration, count * DURATION_TO_PRICE.get(duration, 0)
+        updated = DailyStats.objects.filter(**key).update(
+            count=F('count') + count, minutes=F('minutes') + minutes, revenue=F('revenue') + revenue,
+        )
+        if not updated:
+            DailyStats.objects.create(**key, count=count, minutes=minutes, revenue=revenue)
+
+
+def rebuild(date_from=None, date_to=None):
+    # Recompute the rollup of a date range (everything by default) with one aggregate query,
+    # returns the number of rows written
+    reservations = Reservation.objects.all()
+    stats = DailyStats.objects.all()
+    if date_from:
+        reservations, stats = reservations.filter(start_date__gte=date_from), stats.filter(date__gte=date_from)
+    if date_to:
+        reservations, stats = reservations.filter(start_date__lte=date_to), stats.filter(date__lte=date_to)
+    with transaction.atomic():
+        stats.delete()
+        return len(DailyStats.objects.bulk_create(DailyStats(**row) for row in aggregate(reservations)))
+
+
+def period_range(period, today):
+    if period == 'day':
+        return today, today
+    if period == 'week':
+        monday = today - timedelta(days=today.weekday())
+        return monday, monday + timedelta(days=6)
+    first = today.replace(day=1)
+    return first, (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def period_stats(period='day', today=None):
+    # Rollup rows for every day of the period but today, which is still changing and is
+    # aggregated live from its reservations
+    today = today or timezone.localdate()
+    date_from, date_to = period_range(period, today)
+    rows = list(DailyStats.objects.filter(date__range=(date_from, date_to)).exclude(date=today).values(
+        *KEY_FIELDS, 'count', 'minutes', 'revenue'
+    ))
+    if date_from <= today <= date_to:
+        rows.extend(aggregate(Reservation.objects.filter(start_date=today)))
+
+    courts = Court.objects.filter(is_active=True).count()
+    capacity = courts * (CLOSING_TIME - OPENING_TIME) * ((date_to - date_from).days + 1)
+    summary = {
+        'period': period, 'date_from': date_from, 'date_to': date_to,
+        'count': Counter(), 'minutes': Counter(), 'revenue': Counter(),
+        'tiers': {}, 'hours': Counter(),
+    }
+    for row in rows:
+        status = 'confirmed' if row['confirmed'] else 'pending'
+        for field in ('count', 'minutes', 'revenue'):
+            summary[field][status] += row[field]
+        if row['confirmed']:
+            tier = summary['tiers'].setdefault(row['duration'], Counter())
+            tier['count'] += row['count']
+            tier['revenue'] += row['revenue']
+        summary['hours'][row['hour']] += row['count']
+    summary['occupancy'] = {
+        status: minutes / capacity * 100 if capacity else 0.0 for status, minutes in summary['minutes'].items()
+    }
+    return summary
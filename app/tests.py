@@ -1,3 +1,934 @@
-from django.test import TestCase
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+from dataclasses import replace
+from datetime import date, time, timedelta
+from io import StringIO
+from unittest import mock
+
+import httpx
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, TypeHandler
+
+from .availability import AvailabilityIndex
+from .benchmarking import FakeRequest
+from .booking import book, book_series, cancel_reservations, confirm_reservations, expire_unpaid
+from .callback_data import MAX_LENGTH, InvalidCallbackData, Selection, decode, encode
+from .db import database_sync_to_async
+from .events import EventRelay
+from .exports import COLUMNS
+from .instrumentation import Sample, current_sample
+from .models import Admin, AdminSession, BookingEvent, Court, DailyStats, EventCursor, Reservation, local_datetime
+from .notifications import TelegramNotifier
+from .persistence import DatabasePersistence
+from .ratelimit import TokenBucket, UpdateThrottle
+from .stats import period_stats, rebuild as rebuild_stats
+from .webhooks import TelegramWebhookRouter, respond, webhook_path
+
+class FakeTelegram:
+    # Local stand-in for the Bot API that replays a scripted status sequence per chat
+    def __init__(self, script, delay=0):
+        self.script = script
+        self.delay = delay
+        self.calls = []
+        self.payloads = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request):
+        payload = json.loads(request.content)
+        chat_id = str(payload['chat_id'])
+        self.calls.append(chat_id)
+        self.payloads.append(payload)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        statuses = self.script.get(chat_id, [200])
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        if status == 'timeout':
+            raise httpx.ReadTimeout('timed out', request=request)
+        if isinstance(status, tuple):
+            # (status, raw body), e.g. the HTML error page of a proxy
+            return httpx.Response(status[0], content=status[1])
+        if status == 429:
+            return httpx.Response(429, json={'ok': False, 'parameters': {'retry_after': 0}})
+        if status == 200:
+            return httpx.Response(200, json={'ok': True, 'result': {}})
+        return httpx.Response(status, json={'ok': False, 'description': 'Bad Request: chat not found'})
+
+
+class TelegramNotifierTests(SimpleTestCase):
+    def make_notifier(self, fake, **kwargs):
+        kwargs.setdefault('retries', 3)
+        return TelegramNotifier('token', api_url='http://telegram.test', backoff=0,
+                                transport=httpx.MockTransport(fake), **kwargs)
+
+    async def test_reports_per_admin_results(self):
+        fake = FakeTelegram({'1': [200], '2': [429, 200], '3': [502, 503, 200], '4': [400]})
+        notifier = self.make_notifier(fake)
+
+        results = await notifier.send_message(['1', '2', '3', '4'], 'hello')
+        await notifier.aclose()
+
+        self.assertEqual([r.ok for r in results], [True, True, True, False])
+        self.assertEqual([r.attempts for r in results], [1, 2, 3, 1])
+        self.assertEqual(results[3].error, 'Bad Request: chat not found')
+        self.assertFalse(results[3].retryable)
+
+    async def test_error_pages_that_are_not_json(self):
+        html = b'<html><body>Bad gateway</body></html>'
+        fake = FakeTelegram({'1': [(429, html), (502, html), 200], '2': [(403, html)]})
+        notifier = self.make_notifier(fake)
+
+        results = await notifier.send_message(['1', '2'], 'hello')
+        await notifier.aclose()
+
+        self.assertEqual([(r.ok, r.attempts) for r in results], [(True, 3), (False, 1)])
+        self.assertEqual(results[1].error, 'Forbidden')
+
+    async def test_gives_up_after_retries(self):
+        fake = FakeTelegram({'1': [500]})
+        notifier = self.make_notifier(fake, retries=2)
+
+        [result] = await notifier.send_message(['1'], 'hello')
+        await notifier.aclose()
+
+        self.assertFalse(result.ok)
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(result.status, 500)
+        self.assertTrue(result.retryable)
+
+    async def test_concurrency_is_bounded(self):
+        fake = FakeTelegram({}, delay=0.01)
+        notifier = self.make_notifier(fake, concurrency=3)
+
+        results = await notifier.send_message([str(i) for i in range(20)], 'hello')
+        await notifier.aclose()
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(fake.max_in_flight, 3)
+
+
+def book_in_process(path, days, number, barrier, results):
+    # Forked child: book 20:00 on each of `days` through its own connection to the on-disk database,
+    # in step with the other children so that all of them go for the same slot at once
+    connection.connection = None
+    connection.settings_dict['NAME'] = path
+    outcomes = []
+    for day in days:
+        barrier.wait()
+        try:
+            reservation = book(day, time(20, 0), 60, text=f'player {number}')
+        except OperationalError:
+            outcomes.append((day, 'locked'))
+        else:
+            outcomes.append((day, 'booked' if reservation else 'taken'))
+    connection.close()
+    results.put(outcomes)
+
+
+# Processes racing for each slot and slots raced for in test_concurrent_bookings_for_one_slot,
+# 300 booking attempts by default
+CONTENTION_PROCESSES = int(os.getenv('BOOKING_CONTENTION_PROCESSES', 20))
+CONTENTION_SLOTS = int(os.getenv('BOOKING_CONTENTION_SLOTS', 15))
+
+
+class BookingTests(TransactionTestCase):
+    def setUp(self):
+        self.day = date.today() + timedelta(days=1)
+        # Flushed between tests, so the court made by the migrations is not always there
+        self.court, _ = Court.objects.get_or_create(name='Стіл 1')
+
+    def test_rejects_overlaps(self):
+        self.assertIsNotNone(book(self.day, time(18, 0), 90, text='first'))
+
+        self.assertIsNone(book(self.day, time(17, 0), 90, text='ends inside'))
+        self.assertIsNone(book(self.day, time(19, 0), 60, text='starts inside'))
+        self.assertIsNone(book(self.day, time(17, 30), 180, text='contains'))
+        self.assertIsNotNone(book(self.day, time(19, 30), 60, text='adjacent'))
+        self.assertIsNotNone(book(self.day, time(17, 0), 60, text='adjacent'))
+
+    def test_concurrent_bookings_for_one_slot(self):
+        # Separate processes on an on-disk copy of the database: only lock_writes() keeps them apart,
+        # so every loser must see the slot taken rather than fail on a lock
+        if connection.vendor != 'sqlite':
+            self.skipTest('copies the SQLite test database to a file')
+        processes, slots = CONTENTION_PROCESSES, CONTENTION_SLOTS
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'bookings.sqlite3')
+        copy = sqlite3.connect(path)
+        connection.ensure_connection()
+        connection.connection.backup(copy)
+        copy.close()
+
+        days = [self.day + timedelta(days=i) for i in range(slots)]
+        context = multiprocessing.get_context('fork')
+        barrier, results = context.Barrier(processes), context.Queue()
+        workers = [
+            context.Process(target=book_in_process, args=(path, days, i, barrier, results)) for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        outcomes = [outcome for _ in workers for outcome in results.get(timeout=120)]
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(outcomes), processes * slots)
+        for day in days:
+            self.assertEqual(
+                sorted(outcome for slot, outcome in outcomes if slot == day), ['booked'] + ['taken'] * (processes - 1)
+            )
+        check = sqlite3.connect(path)
+        self.assertEqual(check.execute('SELECT COUNT(*) FROM app_reservation').fetchone()[0], slots)
+        check.close()
+
+    def test_overlaps_past_midnight(self):
+        self.assertIsNotNone(book(self.day, time(23, 0), 120, text='late'))
+
+        self.assertIsNone(book(self.day + timedelta(days=1), time(0, 30), 60, text='early'))
+        self.assertIsNotNone(book(self.day + timedelta(days=1), time(1, 0), 60, text='early'))
+
+    def test_bulk_confirm_and_cancel(self):
+        first = book(self.day, time(10, 0), 60, text='a')
+        second = book(self.day, time(12, 0), 60, text='b')
+        other_day = book(self.day + timedelta(days=1), time(12, 0), 60, text='c')
+
+        self.assertEqual(confirm_reservations([other_day.id, 999], [self.day]), [first.id, second.id, other_day.id])
+        self.assertEqual(Reservation.objects.filter(confirmed=True).count(), 3)
+
+        self.assertEqual(cancel_reservations([first.id, second.id, 999]), [first.id, second.id])
+        self.assertEqual(list(Reservation.objects.values_list('id', flat=True)), [other_day.id])
+
+    def test_expire_unpaid(self):
+        stale = book(self.day, time(10, 0), 60, text='stale', chat_id=1)
+        paid = book(self.day, time(12, 0), 60, text='paid')
+        fresh = book(self.day, time(14, 0), 60, text='fresh')
+        Reservation.objects.filter(id__in=[stale.id, paid.id]).update(created_at=timezone.now() - timedelta(minutes=20))
+        confirm_reservations([paid.id])
+
+        self.assertEqual([reservation.id for reservation in expire_unpaid(15)], [stale.id])
+        self.assertEqual(sorted(Reservation.objects.values_list('id', flat=True)), [paid.id, fresh.id])
+        # The released slot can be booked again straight away
+        self.assertIsNotNone(book(self.day, time(10, 0), 60, text='again'))
+
+    def test_books_first_free_court(self):
+        second = Court.objects.create(name='Стіл 2')
+        Court.objects.create(name='Стіл 3', is_active=False)
+
+        self.assertEqual(book(self.day, time(18, 0), 60, text='a').court, self.court)
+        self.assertEqual(book(self.day, time(18, 30), 60, text='b').court, second)
+        self.assertIsNone(book(self.day, time(18, 0), 60, text='c'))
+        self.assertEqual(book(self.day, time(19, 0), 60, text='d').court, self.court)
+
+        self.assertIsNone(book(self.day, time(19, 0), 60, second.id, text='e'))
+        self.assertEqual(book(self.day, time(19, 30), 60, second.id, text='f').court, second)
+
+    def test_series_checks_every_week_in_one_query_and_inserts_once(self):
+        second = Court.objects.create(name='Стіл 2')
+        weeks = [self.day + timedelta(weeks=week) for week in range(4)]
+        book(weeks[1], time(19, 0), 60, self.court.id, text='first court, week 2')
+        book(weeks[2], time(18, 30), 60, self.court.id, text='first court, week 3')
+        book(weeks[2], time(19, 30), 60, second.id, text='second court, week 3')
+        book(weeks[3], time(19, 0), 120, second.id, text='second court, week 4')
+
+        with CaptureQueriesContext(connection) as queries:
+            reservations, skipped = book_series(self.day, time(19, 0), 60, 4, text='every week')
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(sum(sql.startswith('SELECT') and 'app_reservation' in sql for sql in statements), 1)
+        self.assertEqual(sum(sql.startswith('INSERT INTO "app_reservation"') for sql in statements), 1)
+
+        self.assertEqual(skipped, [weeks[2]])
+        self.assertEqual(
+            [(reservation.start_date, reservation.court) for reservation in reservations],
+            [(weeks[0], self.court), (weeks[1], second), (weeks[3], self.court)],
+        )
+        series_id = reservations[0].id
+        self.assertEqual(
+            list(Reservation.objects.filter(series_id=series_id).order_by('id').values_list('id', flat=True)),
+            [reservation.id for reservation in reservations],
+        )
+        self.assertEqual(DailyStats.objects.aggregate(Sum('count'))['count__sum'], Reservation.objects.count())
+
+        self.assertEqual(book_series(weeks[2], time(19, 0), 60, 1, text='nothing free'), ([], [weeks[2]]))
+        self.assertEqual(len(confirm_reservations(series=[series_id])), 3)
+        self.assertEqual(len(cancel_reservations(series=[series_id])), 3)
+        self.assertFalse(Reservation.objects.filter(text='every week').exists())
+
+    def test_stats_rollup_follows_bookings(self):
+        def rollup():
+            return sorted(DailyStats.objects.exclude(count=0).values_list(
+                'date', 'hour', 'duration', 'confirmed', 'count', 'minutes', 'revenue'
+            ))
+
+        first = book(self.day, time(10, 0), 60, text='a')
+        second = book(self.day, time(10, 30), 90, text='b', court_id=Court.objects.create(name='Стіл 2').id)
+        book(self.day, time(18, 0), 120, text='c')
+        confirm_reservations([first.id, second.id])
+        cancel_reservations([second.id])
+
+        self.assertEqual(rollup(), [
+            (self.day, 10, 60, True, 1, 60, 300),
+            (self.day, 18, 120, False, 1, 120, 550),
+        ])
+        incremental = rollup()
+        rebuild_stats()
+        self.assertEqual(rollup(), incremental)
+
+        summary = period_stats('week', self.day)
+        self.assertEqual((summary['count']['confirmed'], summary['revenue']['pending']), (1, 550))
+        self.assertEqual(summary['tiers'], {60: {'count': 1, 'revenue': 300}})
+        # Today comes from the reservations themselves, not the rollup
+        DailyStats.objects.all().delete()
+        self.assertEqual(period_stats('day', self.day)['count'], {'confirmed': 1, 'pending': 1})
+
+
+class AvailabilityIndexTests(SimpleTestCase):
+    def test_free_slots_per_court(self):
+        day = date(2024, 8, 10)
+        index = AvailabilityIndex()
+        index.load_courts([(1, 'Стіл 1'), (2, 'Стіл 2')])
+        index.load(day, [
+            (10, 1, local_datetime(day, time(9, 0)), local_datetime(day, time(11, 0))),
+            (11, 2, local_datetime(day, time(10, 0)), local_datetime(day, time(12, 0))),
+        ])
+
+        self.assertEqual(index.free_slots(day, 60, 9 * 60)[:4], [(9 * 60, 2), (11 * 60, 1), (11 * 60 + 30, 1), (12 * 60, 1)])
+        self.assertEqual(index.free_start_times(day, 60, 9 * 60, court_id=2)[:2], [9 * 60, 12 * 60])
+
+        version = index.version(day)
+        index.add(12, 1, local_datetime(day, time(11, 0)), local_datetime(day, time(12, 0)))
+        self.assertGreater(index.version(day), version)
+        self.assertEqual(index.free_slots(day, 60, 9 * 60)[:2], [(9 * 60, 2), (12 * 60, 1)])
+
+        index.remove(10)
+        self.assertEqual(index.free_slots(day, 60, 9 * 60)[0], (9 * 60, 1))
+
+    def test_load_range_and_counts(self):
+        day = date(2024, 8, 10)
+        index = AvailabilityIndex()
+        index.load_courts([(1, 'Стіл 1')])
+        # Booked until closing time on day one and past midnight into day two
+        index.load_range([day, day + timedelta(days=1)], [
+            (10, 1, local_datetime(day, time(9, 0)), local_datetime(day + timedelta(days=1), time(10, 0))),
+        ])
+
+        self.assertEqual(index.free_slot_count(day, 60), 0)
+        self.assertEqual(index.free_slot_count(day + timedelta(days=1), 60), 25)
+        self.assertEqual(index.free_start_times(day + timedelta(days=1), 180)[:1], [10 * 60])
+        self.assertEqual(index.free_slot_count(day + timedelta(days=1), 60, court_id=2), 27)
+
+    def test_applies_booking_events_from_other_processes(self):
+        day = date(2024, 8, 10)
+        index = AvailabilityIndex()
+        index.load_courts([(1, 'Стіл 1')])
+        index.load(day, [])
+        start, end = local_datetime(day, time(9, 0)), local_datetime(day, time(23, 0))
+        created = BookingEvent(kind='created', reservation_id=10, data={
+            'court_id': 1, 'start': start.isoformat(), 'end': end.isoformat(),
+        })
+
+        index.apply([created])
+        self.assertEqual(index.free_slot_count(day, 60), 0)
+        version = index.version(day)
+        index.apply([created])
+        self.assertEqual(index.version(day), version)
+        index.apply([created, BookingEvent(kind='cancelled', reservation_id=10)])
+        self.assertEqual(index.free_slot_count(day, 60), 27)
+
+    def test_days_that_have_passed_are_dropped_when_the_window_is_refreshed(self):
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        index = AvailabilityIndex()
+        index.load_courts([(1, 'Стіл 1')])
+        index.load(yesterday, [(10, 1, local_datetime(yesterday, time(9, 0)), local_datetime(yesterday, time(10, 0)))])
+        self.assertEqual(index.free_slot_count(yesterday, 60), 25)
+
+        index.load_range([today, today + timedelta(days=1)], [])
+        self.assertEqual(index.version(yesterday), 0)
+        self.assertFalse(index.is_fresh(yesterday))
+        self.assertEqual(index.free_slot_count(yesterday, 60), 27)
+        # A later cancellation of the old booking finds nothing to update
+        index.remove(10)
+        self.assertEqual(index.version(yesterday), 0)
+
+
+class AdminSelectionTests(SimpleTestCase):
+    def test_ranges_are_checked_before_they_are_expanded(self):
+        from admin_bot import MAX_SELECTION, parse_selection
+
+        self.assertEqual(parse_selection(['3', '5-7', '2024-08-10'], allow_dates=True), ([3, 5, 6, 7], [date(2024, 8, 10)]))
+        with self.assertRaisesMessage(ValueError, 'Invalid selection: 9-2'):
+            parse_selection(['9-2'])
+        with self.assertRaisesMessage(ValueError, f'At most {MAX_SELECTION} ids at once.'):
+            parse_selection(['1-30000000000'])
+        with self.assertRaisesMessage(ValueError, f'At most {MAX_SELECTION} ids at once.'):
+            parse_selection(['1', f'2-{MAX_SELECTION + 1}'])
+        with self.assertRaisesMessage(ValueError, 'Invalid selection: 2024-08-10'):
+            parse_selection(['2024-08-10'])
+
+
+class CallbackDataTests(SimpleTestCase):
+    def test_round_trip(self):
+        selection = Selection(duration=180, court_id=12345, date=date(2024, 8, 10), time=22 * 60 + 30)
+        data = encode('back_time', selection)
+
+        self.assertLessEqual(len(data.encode()), MAX_LENGTH)
+        self.assertEqual(decode(data), ('back_time', selection))
+        self.assertEqual(decode(encode('back_duration')), ('back_duration', Selection()))
+        weekly = Selection(duration=60, date=date(2024, 8, 10), time=600, weeks=8)
+        self.assertEqual(decode(encode('repeat', weekly)), ('repeat', weekly))
+
+    def test_rejects_tampering(self):
+        data = encode('time', Selection(duration=60, date=date(2024, 8, 10), time=600))
+        step, fields, signature = data.split(':')
+
+        with self.assertRaises(InvalidCallbackData):
+            decode(f'{step}:{fields.replace("1o", "2s")}:{signature}')
+        with self.assertRaises(InvalidCallbackData):
+            decode('60')
+
+
+class ReservationBotTests(SimpleTestCase):
+    def test_weekly_repeat_is_an_option_of_the_contacts_prompt(self):
+        import reservation_bot
+
+        self.assertEqual(
+            [reservation_bot.weeks_ua(weeks) for weeks in (1, 4, 8, 11, 21, 22, 25)],
+            ['1 тиждень', '4 тижні', '8 тижнів', '11 тижнів', '21 тиждень', '22 тижні', '25 тижнів'],
+        )
+        selection = Selection(duration=60, date=date(2024, 8, 13), time=19 * 60)
+        buttons = [row[0] for row in reservation_bot.build_contacts_keyboard(selection).inline_keyboard]
+        self.assertEqual([button.text for button in buttons], ['🔁 Щотижня, 4 тижні', '🔁 Щотижня, 8 тижнів', '⬅️ Назад'])
+        self.assertEqual(decode(buttons[0].callback_data), ('repeat', replace(selection, weeks=4)))
+
+        weekly = [row[0].text for row in reservation_bot.build_contacts_keyboard(replace(selection, weeks=4)).inline_keyboard]
+        self.assertEqual(weekly, ['🔁 Щотижня, 8 тижнів', '1️⃣ Лише цей раз', '⬅️ Назад'])
+
+    @override_settings(ADMIN_BOT_TOKEN='1:test')
+    async def test_bot_api_calls_of_handlers_are_timed(self):
+        import admin_bot
+
+        fake = FakeRequest()
+        application = admin_bot.build_application(Application.builder().updater(None), request=fake)
+        sample = Sample()
+        token = current_sample.set(sample)
+        try:
+            await application.bot.get_me()
+        finally:
+            current_sample.reset(token)
+        self.assertEqual((fake.calls, sample.api_calls), (1, 1))
+
+
+class KeyboardCacheTests(TransactionTestCase):
+    async def test_bookings_and_cancellations_miss_the_cached_keyboards(self):
+        import reservation_bot
+        from . import repository
+
+        day = timezone.localdate() + timedelta(days=1)
+        await Court.objects.aget_or_create(name='Стіл 1')
+        await repository.load_courts()
+        await reservation_bot.load_bookable_days()
+        selection = Selection(duration=60, date=day)
+
+        def times(keyboard):
+            return [row[0].text for row in keyboard.inline_keyboard[:-1]]
+
+        keyboard = await reservation_bot.get_time_keyboard(selection)
+        dates = await reservation_bot.get_date_keyboard(Selection(duration=60))
+        self.assertIn('19:00', times(keyboard))
+        # Nothing changed: the very same keyboards come from the cache
+        self.assertIs(await reservation_bot.get_time_keyboard(selection), keyboard)
+        self.assertIs(await reservation_bot.get_date_keyboard(Selection(duration=60)), dates)
+
+        reservation = await repository.book(day, time(19, 0), 60, text='booked')
+        booked = await reservation_bot.get_time_keyboard(selection)
+        self.assertNotIn('19:00', times(booked))
+        self.assertIsNot(await reservation_bot.get_date_keyboard(Selection(duration=60)), dates)
+
+        await repository.cancel_reservations([reservation.id])
+        self.assertIn('19:00', times(await reservation_bot.get_time_keyboard(selection)))
+
+
+class DatabasePersistenceTests(TransactionTestCase):
+    async def test_changes_are_written_in_one_batch_and_reloaded(self):
+        persistence = DatabasePersistence('test_bot')
+        await persistence.update_user_data(1, {'admin_logged_in': True})
+        await persistence.update_user_data(2, {'reservation': 'token'})
+        await persistence.update_conversation('booking', (10, 2), 0)
+        await persistence.update_conversation('booking', (11, 3), 0)
+
+        await persistence.flush()
+        await persistence.update_conversation('booking', (11, 3), None)
+        await persistence.drop_user_data(2)
+        await persistence.flush()
+
+        restarted = DatabasePersistence('test_bot')
+        self.assertEqual(await restarted.get_user_data(), {1: {'admin_logged_in': True}})
+        self.assertEqual(await restarted.get_conversations('booking'), {(10, 2): 0})
+        self.assertEqual(await DatabasePersistence('other_bot').get_user_data(), {})
+
+    async def test_writes_a_snapshot_and_gives_up_on_bad_data(self):
+        persistence = DatabasePersistence('test_bot')
+        user_data = {'reservation': 'first'}
+        await persistence.update_user_data(1, user_data)
+        user_data['reservation'] = 'changed after the update'
+        await persistence.update_user_data(2, {'when': date(2024, 8, 10)})  # Not JSON, dropped alone
+        await persistence.flush()
+        self.assertEqual(await DatabasePersistence('test_bot').get_user_data(), {1: {'reservation': 'first'}})
+
+        with mock.patch.object(persistence, '_write', side_effect=OperationalError('database is locked')) as write:
+            await persistence.update_user_data(3, {'reservation': 'never written'})
+            for _ in range(persistence.FLUSH_ATTEMPTS + 1):
+                await persistence.flush()
+        # Retried, then given up on instead of blocking every later batch
+        self.assertEqual(write.call_count, persistence.FLUSH_ATTEMPTS)
+        await persistence.update_user_data(4, {'reservation': 'next'})
+        await persistence.flush()
+        self.assertEqual(sorted(await DatabasePersistence('test_bot').get_user_data()), [1, 4])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        court, _ = Court.objects.get_or_create(name='Стіл 1')
+        for day, start, duration in ((10, time(22, 0), 180), (11, time(9, 0), 60), (20, time(9, 0), 60)):
+            Reservation.objects.create(
+                court=court, start_date=date(2024, 8, day), start_time=start, duration=duration, text=f'Гравець, {day}'
+            )
+
+    def test_command_writes_csv_with_price_and_end_time(self):
+        output = StringIO()
+        call_command('export_reservations', '--from', '2024-08-10', '--to', '2024-08-11', stdout=output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(COLUMNS))
+        self.assertEqual(len(lines), 3)
+        self.assertIn(',2024-08-10,22:00,2024-08-11,01:00,180,750,False,,"Гравець, 10",', lines[1])
+
+    def test_view_streams_json_lines_to_staff_only(self):
+        url = '/admin/reservations/export/?from=2024-08-10&to=2024-08-11&format=jsonl'
+        self.assertEqual(self.client.get(url).status_code, 302)  # To the admin login
+
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        response = self.client.get(url)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([row['start_date'] for row in rows], ['2024-08-10', '2024-08-11'])
+        self.assertEqual((rows[0]['end_date'], rows[0]['end_time'], rows[0]['price']), ('2024-08-11', '01:00', 750))
+        self.assertEqual(self.client.get(url.replace('jsonl', 'xml')).status_code, 400)
+
+
+class ReservationAdminTests(TestCase):
+    url = '/admin/app/reservation/'
+
+    def setUp(self):
+        court, _ = Court.objects.get_or_create(name='Стіл 1')
+        for hour, text in ((9, 'Олена Коваленко, +380501112233'), (11, 'Тарас Мельник, +380674445566')):
+            Reservation.objects.create(
+                court=court, start_date=date(2024, 8, 10), start_time=time(hour, 0), duration=60, text=text
+            )
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+
+    def test_search_matches_substrings_of_name_and_phone(self):
+        for term, expected in (('коваленко', ['Олена Коваленко, +380501112233']), ('4455', ['Тарас Мельник, +380674445566'])):
+            response = self.client.get(self.url, {'q': term})
+            self.assertEqual([r.text for r in response.context['cl'].result_list], expected)
+
+        Reservation.objects.filter(text__startswith='Тарас').update(text='Тарас Бойко, +380674445566')
+        response = self.client.get(self.url, {'q': 'Бойко'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+
+    def test_confirm_action_updates_reservations_and_stats(self):
+        ids = list(Reservation.objects.values_list('id', flat=True))
+        rebuild_stats()
+
+        self.client.post(self.url, {'action': 'confirm_selected', '_selected_action': ids})
+
+        self.assertEqual(Reservation.objects.filter(confirmed=True).count(), 2)
+        self.assertEqual(period_stats('day', date(2024, 8, 10))['count'], {'confirmed': 2})
+
+
+class SeedDataTests(TestCase):
+    def seed(self, *args):
+        call_command('seed_data', '--reservations', '500', '--courts', '3', '--admins', '2', *args, stdout=StringIO())
+        return list(Reservation.objects.order_by('id').values_list(
+            'court__name', 'start_datetime', 'end_datetime', 'duration', 'confirmed', 'text'
+        ))
+
+    def test_rows_are_reproducible_and_never_overlap(self):
+        rows = self.seed()
+
+        self.assertEqual(len(rows), 500)
+        self.assertEqual({row[3] for row in rows}, {60, 90, 120, 180})
+        self.assertEqual({row[4] for row in rows}, {True, False})
+        for court in {row[0] for row in rows}:
+            spans = sorted(row[1:3] for row in rows if row[0] == court)
+            self.assertTrue(all(end <= start for (_, end), (start, _) in zip(spans, spans[1:])))
+        self.assertEqual(DailyStats.objects.aggregate(total=Sum('count'))['total'], 500)
+        self.assertEqual((Admin.objects.count(), AdminSession.objects.count()), (2, 10))
+
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.assertEqual(self.seed('--replace'), rows)
+
+
+class BookingEventTests(TransactionTestCase):
+    def setUp(self):
+        self.day = date.today() + timedelta(days=1)
+        Court.objects.get_or_create(name='Стіл 1')
+
+    def test_changes_are_published_with_the_booking(self):
+        reservation = book(self.day, time(19, 0), 90, text='Олена, +380501112233', username='olena', chat_id=7)
+        confirm_reservations([reservation.id])
+        cancel_reservations([reservation.id])
+
+        events = list(BookingEvent.objects.order_by('id'))
+        self.assertEqual([event.kind for event in events], ['created', 'confirmed', 'cancelled'])
+        self.assertEqual({event.reservation_id for event in events}, {reservation.id})
+        self.assertEqual(
+            (events[0].data['court'], events[0].data['time'], events[0].data['duration'], events[0].data['chat_id']),
+            ('Стіл 1', '19:00', 90, 7),
+        )
+
+    async def test_durable_relay_resumes_and_retries(self):
+        await database_sync_to_async(book)(self.day, time(9, 0), 60, text='before the relay started')
+        received = []
+
+        async def handler(events):
+            if any(event.data.get('text') == 'fails once' for event in events) and not received:
+                received.append(None)
+                raise RuntimeError('delivery failed')
+            received.extend(event.data['text'] for event in events)
+
+        relay = EventRelay(handler, 'test_consumer', batch_size=2)
+        self.assertEqual(await relay.poll(), 0)  # Starts after the existing events
+        for hour, text in ((10, 'fails once'), (11, 'second'), (12, 'third')):
+            await database_sync_to_async(book)(self.day, time(hour, 0), 60, text=text)
+
+        with self.assertRaises(RuntimeError):
+            await relay.poll()
+        # After a restart the stored cursor still points before the failed batch
+        self.assertEqual(await EventRelay(handler, 'test_consumer', batch_size=2).poll(), 3)
+        self.assertEqual(received, [None, 'fails once', 'second', 'third'])
+        cursor = await EventCursor.objects.aget(consumer='test_consumer')
+        self.assertEqual(cursor.last_id, (await BookingEvent.objects.alatest('id')).id)
+
+    def admin_relay(self, fake):
+        import admin_bot
+
+        notifier = TelegramNotifier('token', api_url='http://telegram.test', backoff=0, retries=3,
+                                    transport=httpx.MockTransport(fake))
+        return EventRelay(functools.partial(admin_bot.notify_admins, notifier), 'test_admin_notifications')
+
+    async def test_admin_bot_notifies_every_logged_in_admin(self):
+        from .admin_sessions import admin_registry
+
+        await AdminSession.objects.abulk_create([AdminSession(chat_id='10'), AdminSession(chat_id='11')])
+        admin_registry.invalidate()
+        fake = FakeTelegram({})
+        relay = self.admin_relay(fake)
+        await relay.poll()
+        reservation = await database_sync_to_async(book)(self.day, time(19, 0), 60, text='Олена', username='olena')
+        await database_sync_to_async(confirm_reservations)([reservation.id])
+
+        self.assertEqual(await relay.poll(), 2)
+        self.assertEqual(sorted(
+            (payload['chat_id'], payload['text'].splitlines()[0], 'reply_markup' in payload) for payload in fake.payloads
+        ), [
+            (chat_id, f'🔔 Нове бронювання на {self.day} о 19:00 на 1.0 години.', True) for chat_id in ('10', '11')
+        ])
+
+    async def test_series_is_one_admin_notification(self):
+        from .admin_sessions import admin_registry
+
+        await AdminSession.objects.acreate(chat_id='10')
+        admin_registry.invalidate()
+        fake = FakeTelegram({})
+        relay = self.admin_relay(fake)
+        await relay.poll()
+        reservations, _ = await database_sync_to_async(book_series)(
+            self.day, time(19, 0), 60, 3, text='Олена', username='olena'
+        )
+
+        self.assertEqual(await relay.poll(), 1)
+        [payload] = fake.payloads
+        lines = payload['text'].splitlines()
+        self.assertEqual((payload['chat_id'], lines[0]), ('10', '🔁 Нове щотижневе бронювання (3 раз.) о 19:00 на 1.0 години:'))
+        self.assertEqual(len([line for line in lines if line.startswith('📅')]), 3)
+        self.assertEqual(payload['reply_markup']['inline_keyboard'][0][0]['callback_data'],
+                         f'confirmseries_{reservations[0].id}')
+
+    async def test_players_get_one_message_for_their_expired_bookings(self):
+        import reservation_bot
+
+        await database_sync_to_async(book_series)(self.day, time(19, 0), 60, 3, text='every week', chat_id=7)
+        await database_sync_to_async(book)(self.day, time(10, 0), 60, text='once', chat_id=8)
+        await Reservation.objects.aupdate(created_at=timezone.now() - timedelta(hours=1))
+
+        with mock.patch.object(reservation_bot.user_notifier, 'send_messages', mock.AsyncMock(return_value=[])) as send:
+            await reservation_bot.sweep_unpaid()
+
+        messages = {chat_id: text for chat_id, text, _ in send.call_args.args[0]}
+        self.assertEqual(sorted(messages), [7, 8])
+        self.assertEqual(messages[7].count('\n• '), 3)
+        self.assertTrue(messages[8].startswith('⌛ Ваше бронювання на '))
+
+    async def test_admin_notifications_survive_server_errors_and_timeouts(self):
+        from .admin_sessions import admin_registry
+
+        await AdminSession.objects.abulk_create([AdminSession(chat_id='10'), AdminSession(chat_id='11')])
+        admin_registry.invalidate()
+        fake = FakeTelegram({'10': [502, 200], '11': ['timeout', 'timeout', 200]})
+        relay = self.admin_relay(fake)
+        await relay.poll()
+        await database_sync_to_async(book)(self.day, time(19, 0), 60, text='Олена', username='olena')
+
+        self.assertEqual(await relay.poll(), 1)
+        self.assertEqual(sorted(fake.calls), ['10', '10', '11', '11', '11'])
+
+        # Nobody reachable: the cursor stays put and the next poll delivers the event
+        await database_sync_to_async(book)(self.day, time(21, 0), 60, text='Андрій', username='andriy')
+        fake.script = {'10': [502], '11': [502]}
+        with self.assertRaises(RuntimeError):
+            await relay.poll()
+        fake.script = {}
+        fake.calls.clear()
+        self.assertEqual(await relay.poll(), 1)
+        self.assertEqual(sorted(fake.calls), ['10', '11'])
+
+        # Failures that retrying cannot fix are given up on
+        await database_sync_to_async(book)(self.day, time(9, 0), 60, text='Ігор', username='ihor')
+        fake.script = {'10': [400], '11': [400]}
+        self.assertEqual(await relay.poll(), 1)
+
+
+class RepositoryTests(TransactionTestCase):
+    async def test_login_checks_credentials_and_starts_the_session_in_one_call(self):
+        from . import repository
+        from .admin_sessions import admin_registry
+
+        admin_registry.invalidate()
+        await database_sync_to_async(Admin(username='admin', password='secret').save)()
+
+        self.assertFalse(await repository.login('admin', 'wrong', 10, 100))
+        self.assertFalse(await repository.login('nobody', 'secret', 10, 100))
+        self.assertTrue(await repository.login('admin', 'secret', 11, 100))
+        self.assertEqual(await repository.admin_chat_ids(), ['11'])
+        self.assertTrue(await repository.logout(11))
+        self.assertFalse(await AdminSession.objects.aexists())
+
+    async def test_sessions_are_bound_to_the_chat_and_user_and_expire(self):
+        from . import admin_sessions, repository
+
+        admin_sessions.admin_registry.invalidate()
+        await database_sync_to_async(Admin(username='admin', password='secret').save)()
+        # Made before sessions were bound to a user: still notified, but has to log in again for commands
+        await AdminSession.objects.acreate(chat_id='9')
+
+        with mock.patch.object(admin_sessions, 'check_password', wraps=admin_sessions.check_password) as check:
+            self.assertTrue(await repository.login('admin', 'secret', 10, 100))
+            self.assertTrue(await repository.login('admin', 'secret', 11, 101))
+            self.assertFalse(await repository.login('admin', 'wrong', 11, 101))
+        self.assertEqual(check.call_count, 2)  # The second login with the same password skipped the hasher
+
+        self.assertTrue(await repository.is_admin(10, 100))
+        self.assertFalse(await repository.is_admin(10, 101))  # Someone else in the same group chat
+        self.assertFalse(await repository.is_admin(11, 100))
+        self.assertFalse(await repository.is_admin(9, None))
+        self.assertEqual(await repository.admin_chat_ids(), ['10', '11', '9'])
+        # Nothing secret is stored
+        self.assertEqual(
+            await database_sync_to_async(list)(AdminSession.objects.order_by('chat_id').values_list('chat_id', 'user_id')),
+            [('10', 100), ('11', 101), ('9', None)],
+        )
+
+        await AdminSession.objects.filter(chat_id='10').aupdate(expires_at=timezone.now())
+        admin_sessions.admin_registry.invalidate()
+        self.assertFalse(await repository.is_admin(10, 100))
+        self.assertEqual(await repository.admin_chat_ids(), ['11', '9'])
+
+
+class AdminRegistryTests(TestCase):
+    def test_cache_expires_after_its_ttl_and_logout_evicts_at_once(self):
+        from .admin_sessions import AdminRegistry
+
+        registry = AdminRegistry(ttl=60)
+        admin = Admin.objects.create(username='admin', password='secret')
+        other = Admin.objects.create(username='other', password='secret')
+        with mock.patch('app.admin_sessions.time.monotonic', return_value=1000):
+            registry.login(10, 100, admin)
+            registry.login(11, 101, other)
+            registry.load()
+        self.assertEqual(registry.chat_ids(), ['10', '11'])
+
+        # Logging out takes effect in this process straight away
+        self.assertTrue(registry.logout(11))
+        self.assertFalse(registry.is_authorized(11, 101))
+        self.assertEqual(registry.chat_ids(), ['10'])
+
+        # Deleting the admin (its sessions go with it) is seen by other processes once their cache expires
+        admin.delete()
+        with mock.patch('app.admin_sessions.time.monotonic', return_value=1059):
+            self.assertTrue(registry.is_fresh())
+            self.assertTrue(registry.is_authorized(10, 100))
+        with mock.patch('app.admin_sessions.time.monotonic', return_value=1060):
+            self.assertFalse(registry.is_fresh())
+            registry.load()
+        self.assertFalse(registry.is_authorized(10, 100))
+        self.assertEqual(registry.chat_ids(), [])
+
+    def test_expired_sessions_stop_working_before_the_next_load(self):
+        from .admin_sessions import AdminRegistry
+
+        registry = AdminRegistry(ttl=60, session_days=1)
+        registry.login(10, 100, Admin.objects.create(username='admin', password='secret'))
+        self.assertTrue(registry.is_authorized(10, 100))
+
+        with mock.patch('app.admin_sessions.timezone.now', return_value=timezone.now() + timedelta(days=1, seconds=1)):
+            self.assertFalse(registry.is_authorized(10, 100))
+            self.assertEqual(registry.chat_ids(), [])
+            registry.load()
+        # Dropped from the database when the cache was reloaded
+        self.assertFalse(AdminSession.objects.exists())
+
+    def test_sessions_without_an_expiry_never_expire(self):
+        from .admin_sessions import AdminRegistry
+
+        registry = AdminRegistry(ttl=60)
+        registry.login(10, 100, Admin.objects.create(username='admin', password='secret'))
+        # As left by clearing the expiry in the Django admin
+        AdminSession.objects.update(expires_at=None)
+        registry.load()
+
+        self.assertTrue(registry.is_authorized(10, 100))
+        self.assertFalse(registry.is_authorized(10, 101))
+        self.assertEqual(registry.chat_ids(), ['10'])
+
+
+class UpdateThrottleTests(SimpleTestCase):
+    async def start_application(self):
+        self.now = 0.0
+        self.throttle = UpdateThrottle(rate=2, burst=3, duplicate_window=1, busy_text='busy', clock=lambda: self.now)
+        self.fake = FakeRequest()
+        self.application = Application.builder().token('1:test').request(self.fake).updater(None).build()
+        self.application.add_handler(TypeHandler(Update, self.throttle.throttle), group=-1)
+        self.handled = []
+        self.application.add_handler(CallbackQueryHandler(self.handle))
+        await self.application.initialize()
+
+    async def handle(self, update, context):
+        self.handled.append((update.effective_chat.id, update.callback_query.data))
+
+    async def tap(self, chat_id, data, at):
+        self.now = at
+        update_id = len(self.handled) + self.throttle.coalesced + self.throttle.limited + 1
+        await self.application.process_update(Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'chat_instance': str(chat_id), 'data': data,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Player'},
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': '👋'},
+        }}, self.application.bot))
+
+    async def test_double_taps_are_coalesced_and_answered(self):
+        await self.start_application()
+        calls = self.fake.calls
+        for i in range(10):
+            await self.tap(1, 'date:x', at=i * 0.2)  # Every tap within a second of the previous one
+        await self.tap(1, 'date:x', at=10)
+
+        self.assertEqual(self.handled, [(1, 'date:x'), (1, 'date:x')])
+        self.assertEqual(self.throttle.coalesced, 9)
+        self.assertEqual(self.fake.calls - calls, 9)  # One answerCallbackQuery each, no edits
+
+    async def test_flood_from_one_chat_does_not_limit_the_others(self):
+        await self.start_application()
+        for i in range(20):
+            await self.tap(1, f'date:{i}', at=0)
+        await self.tap(2, 'date:0', at=0)
+        await self.tap(1, 'date:20', at=0.4)  # Not enough time for a new token yet
+        await self.tap(1, 'date:21', at=1)
+
+        self.assertEqual([data for chat, data in self.handled if chat == 1], ['date:0', 'date:1', 'date:2', 'date:21'])
+        self.assertIn((2, 'date:0'), self.handled)
+        self.assertEqual(self.throttle.limited, 18)
+
+    def test_global_bucket_paces_instead_of_dropping(self):
+        bucket = TokenBucket(rate=10, capacity=2, now=0)
+        self.assertEqual([bucket.reserve(0) for _ in range(4)], [0, 0, 0.1, 0.2])
+        self.assertTrue(bucket.take(1))
+
+
+class WebhookRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.django_paths = []
+
+        async def django_application(scope, receive, send):
+            self.django_paths.append(scope['path'])
+            await respond(send, 200, b'django')
+
+        self.bots = [Application.builder().token(token).updater(None).build() for token in ('1:first', '2:second')]
+        self.router = TelegramWebhookRouter(
+            django_application, self.bots, secret_token='webhook-secret', metrics_token='metrics-secret'
+        )
+
+    async def request(self, path, method='POST', body=b'', headers=()):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.router({'type': 'http', 'path': path, 'method': method, 'headers': list(headers)}, receive, send)
+        return sent[0]['status'], sent[1]['body']
+
+    async def test_metrics_need_the_bearer_token(self):
+        self.assertEqual((await self.request('/metrics', 'GET'))[0], 403)
+        self.assertEqual((await self.request('/metrics', 'GET', headers=[(b'authorization', b'Bearer nope')]))[0], 403)
+        self.assertEqual((await self.request('/metrics', headers=[(b'authorization', b'Bearer metrics-secret')]))[0], 405)
+        status, body = await self.request('/metrics', 'GET', headers=[(b'authorization', b'Bearer metrics-secret')])
+        self.assertEqual(status, 200)
+        self.assertIn(b'# TYPE', body)
+
+        # Without a token there is no endpoint, Django answers
+        self.router.metrics_token = None
+        self.assertEqual(await self.request('/metrics', 'GET'), (200, b'django'))
+
+    async def test_updates_are_routed_to_their_bot_after_the_secret_check(self):
+        secret = [(b'x-telegram-bot-api-secret-token', b'webhook-secret')]
+        update = json.dumps({'update_id': 7, 'message': {
+            'message_id': 1, 'date': 0, 'chat': {'id': 5, 'type': 'private'}, 'text': '/start',
+        }}).encode()
+        first, second = (webhook_path(bot.bot.token) for bot in self.bots)
+
+        self.assertEqual((await self.request(second, body=update, headers=secret))[0], 200)
+        self.assertTrue(self.bots[0].update_queue.empty())
+        self.assertEqual((await self.bots[1].update_queue.get()).update_id, 7)
+
+        self.assertEqual((await self.request(first, body=update))[0], 403)
+        self.assertEqual((await self.request(first, body=update, headers=[(secret[0][0], b'wrong')]))[0], 403)
+        self.assertEqual((await self.request(first, 'GET', headers=secret))[0], 405)
+        self.assertEqual((await self.request(first, body=b'{not json', headers=secret))[0], 400)
+        self.assertEqual((await self.request(first, body=b'[]', headers=secret))[0], 400)
+        self.assertTrue(self.bots[0].update_queue.empty())
+
+    async def test_other_paths_fall_through_to_django(self):
+        self.assertEqual(await self.request('/admin/', 'GET'), (200, b'django'))
+        self.assertEqual(await self.request('/telegram/unknown/', body=b'{}'), (200, b'django'))
+        self.assertEqual(self.django_paths, ['/admin/', '/telegram/unknown/'])
 
-# Create your tests here.
@@ -1,3 +1,27 @@
-from django.shortcuts import render
+from datetime import date
 
-# Create your views here.
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+
+from .exports import FORMATS, aexport_lines, current_month, export_lines
+
+
+@staff_member_required
+def export_reservations(request):
+    # /admin/reservations/export/?from=YYYY-MM-DD&to=YYYY-MM-DD&format=csv|jsonl, this month by default
+    first, last = current_month()
+    try:
+        date_from = date.fromisoformat(request.GET['from']) if request.GET.get('from') else first
+        date_to = date.fromisoformat(request.GET['to']) if request.GET.get('to') else last
+    except ValueError:
+        return HttpResponseBadRequest('Dates must be YYYY-MM-DD.')
+    format = request.GET.get('format', 'csv')
+    if format not in FORMATS:
+        return HttpResponseBadRequest(f"Format must be one of: {', '.join(FORMATS)}.")
+
+    _, _, content_type, extension = FORMATS[format]
+    lines = aexport_lines if isinstance(request, ASGIRequest) else export_lines
+    response = StreamingHttpResponse(lines(date_from, date_to, format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="reservations_{date_from}_{date_to}.{extension}"'
+    return response
@@ -0,0 +1,121 @@
+import hashlib
+import hmac
+import json
+
+from telegram import Update
+
+from .instrumentation import metrics
+
+
+def webhook_path(token):
+    # Unguessable per-bot path, derived from the bot token so it never has to be configured
+    return f"/telegram/{hashlib.sha256(token.encode()).hexdigest()[:32]}/"
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def respond(send, status, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class TelegramWebhookRouter:
+    """ASGI app that feeds Telegram webhook calls into the bots' update queues and passes the rest to Django."""
+
+    def __init__(self, django_application, applications, secret_token=None, webhook_url=None, metrics_token=None):
+        self.django_application = django_application
+        self.applications = {webhook_path(application.bot.token): application for application in applications}
+        self.secret_token = secret_token.encode() if secret_token else None
+        self.webhook_url = webhook_url
+        self.metrics_token = metrics_token.encode() if metrics_token else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['path'] == '/metrics' and self.metrics_token:
+            return await self.handle_metrics(scope, send)
+
+        application = self.applications.get(scope['path']) if scope['type'] == 'http' else None
+        if application is None:
+            return await self.django_application(scope, receive, send)
+        await self.handle_update(application, scope, receive, send)
+
+    async def handle_metrics(self, scope, send):
+        if scope['method'] != 'GET':
+            return await respond(send, 405)
+
+        authorization = dict(scope['headers']).get(b'authorization', b'')
+        if not hmac.compare_digest(authorization, b'Bearer ' + self.metrics_token):
+            return await respond(send, 403)
+        await respond(send, 200, metrics.prometheus().encode())
+
+    async def handle_update(self, application, scope, receive, send):
+        if scope['method'] != 'POST':
+            return await respond(send, 405)
+
+        if self.secret_token:
+            token = dict(scope['headers']).get(b'x-telegram-bot-api-secret-token', b'')
+            if not hmac.compare_digest(token, self.secret_token):
+                return await respond(send, 403)
+
+        try:
+            data = json.loads(await read_body(receive))
+            # Update.de_json() returns None for empty or non-object bodies instead of failing
+            if not isinstance(data, dict):
+                raise ValueError('An update is a JSON object')
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError):
+            return await respond(send, 400)
+
+        # Answer Telegram straight away, the application's own loop processes the queue
+        await application.update_queue.put(update)
+        await respond(send, 200)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        # Mirrors what Application.run_polling() does around its polling loop
+        for path, application in self.applications.items():
+            await application.initialize()
+            if application.post_init:
+                await application.post_init(application)
+            if self.webhook_url:
+                await application.bot.set_webhook(
+                    url=self.webhook_url.rstrip('/') + path,
+                    secret_token=self.secret_token.decode() if self.secret_token else None,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            await application.start()
+
+    async def shutdown(self):
+        for application in self.applications.values():
+            if application.running:
+                await application.stop()
+                if application.post_stop:
+                    await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
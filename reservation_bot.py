@@ -1,17 +1,27 @@
+import asyncio
 import os
 import django
-import requests
 
 # Set the settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tennis_reservation_app.settings')
 django.setup()
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackContext, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
-from datetime import datetime, timedelta, time
-from asgiref.sync import sync_to_async
-from app.models import Reservation, AdminSession
+from telegram.helpers import escape_markdown
+from telegram.ext import Application, CommandHandler, CallbackContext, CallbackQueryHandler, ConversationHandler, MessageHandler, TypeHandler, filters
+from dataclasses import replace
+from datetime import time as dt_time, timedelta
+from functools import lru_cache
+from app.instrumentation import instrument_application, instrument_builder
+from app.availability import availability_index, OPENING_TIME, SLOT_MINUTES
+from app import events, repository
+from app.callback_data import InvalidCallbackData, Selection, decode, encode
+from app.models import DURATION_TO_PRICE, local_datetime
+from app.notifications import TelegramNotifier
+from app.persistence import DatabasePersistence
+from app.ratelimit import UpdateThrottle
 from django.conf import settings
+from django.utils import timezone
 
 # Custom day names in Ukrainian
 DAY_NAMES_UA = {
@@ -24,16 +34,17 @@ DAY_NAMES_UA = {
     'Sunday': 'Неділя',
 }
 
-# Duration to price mapping
-DURATION_TO_PRICE = {
-    60: 300,   # 1 hour
-    90: 450,   # 1.5 hours
-    120: 550,  # 2 hours
-    180: 750   # 3 hours
-}
+# How many days ahead, today included, can be booked
+BOOKING_DAYS = 14
+# Lengths of the weekly series offered next to the contact details prompt
+REPEAT_WEEKS = (4, 8)
 
 # States for conversation
-DURATION_SELECTION, DATE_SELECTION, TIME_SELECTION, NAME_PHONE, CONFIRMATION = range(5)
+# Only the contact details step is a conversation state, every button carries its own state
+NAME_PHONE = 0
+
+# Messages to players go out through this bot's own token, admins are notified by admin_bot.py
+user_notifier = TelegramNotifier(settings.RESERVATION_BOT_TOKEN)
 
 async def start(update: Update, context: CallbackContext):
     keyboard = [
@@ -45,25 +56,40 @@ async def start(update: Update, context: CallbackContext):
         reply_markup=reply_markup
     )
 
+def format_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+# Keyboards are immutable, so they are built once and shared between all users.
+# Every button carries the whole selection so far, signed, so no tap depends on state kept by this process.
+DURATION_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("1 година - 300₴ ⏱️", callback_data=encode('duration', Selection(duration=60)))],
+    [InlineKeyboardButton("1,5 години - 450₴ ⏱️", callback_data=encode('duration', Selection(duration=90)))],
+    [InlineKeyboardButton("2 години - 550₴ ⏱️ (275 ₴/година)", callback_data=encode('duration', Selection(duration=120)))],
+    [InlineKeyboardButton("3 години - 750₴ ⏱️ (250 ₴/година)", callback_data=encode('duration', Selection(duration=180)))],
+])
+
+def read_selection(query):
+    # None for buttons that were not signed by this deployment (e.g. from before a SECRET_KEY change)
+    try:
+        _, selection = decode(query.data)
+    except InvalidCallbackData:
+        return None
+    return selection
+
+async def expired_button(query):
+    await query.answer()
+    await query.edit_message_text("⚠️ Ця кнопка застаріла. Почніть бронювання знову: /start")
+    return ConversationHandler.END
+
 async def start_reservation(update: Update, context: CallbackContext):
     query = update.callback_query
     await query.answer()
 
-    durations = [
-        ("1 година - 300₴ ⏱️", "60"),
-        ("1,5 години - 450₴ ⏱️", "90"),
-        ("2 години - 550₴ ⏱️ (275 ₴/година)", "120"),
-        ("3 години - 750₴ ⏱️ (250 ₴/година)", "180"),
-    ]
-
-    keyboard = [[InlineKeyboardButton(text, callback_data=value)] for text, value in durations]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await query.edit_message_text(
         "⏳ Оберіть тривалість:",
-        reply_markup=reply_markup
+        reply_markup=DURATION_KEYBOARD
     )
-    return DURATION_SELECTION
+    return ConversationHandler.END
 
 def format_date_ua(date_obj, escaped=False):
     # Format date as "09.08, Пʼятниця"
@@ -71,249 +97,268 @@ def format_date_ua(date_obj, escaped=False):
     date = date_obj.strftime(f'%d\.%m \({day_name}\)') if escaped else date_obj.strftime(f'%d.%m, {day_name}')
     return date
 
-async def select_date(update: Update, context: CallbackContext):
+@lru_cache(maxsize=64)
+def build_court_keyboard(courts, selection):
+    # `courts` is a tuple of (id, name) pairs, so renaming or adding a court misses the cache
+    keyboard = [[InlineKeyboardButton("🎲 Будь-який вільний стіл", callback_data=encode('court', selection))]]
+    keyboard.extend(
+        [InlineKeyboardButton(f"🏓 {name}", callback_data=encode('court', replace(selection, court_id=court_id)))]
+        for court_id, name in courts
+    )
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=encode('back_duration'))])
+    return InlineKeyboardMarkup(keyboard)
+
+async def select_court(update: Update, context: CallbackContext):
     query = update.callback_query
+    selection = read_selection(query)
+    if selection is None:
+        return await expired_button(query)
 
-    if query.data == 'back_to_duration':  # Handle back to duration selection
-        await start_reservation(update, context)
-        return DURATION_SELECTION
+    courts = await repository.get_courts()
+    if len(courts) < 2:
+        # Nothing to choose from, go straight to the dates
+        return await show_dates(query, selection)
 
     await query.answer()
+    await query.edit_message_text(
+        "🏓 Оберіть стіл:",
+        reply_markup=build_court_keyboard(tuple(courts.items()), selection)
+    )
+    return ConversationHandler.END
 
-    if query.data != 'back_to_date':
-        context.user_data['reservation_duration'] = int(query.data)
-
-    today = datetime.today()
-    dates = [(today + timedelta(days=i)) for i in range(14)]
-
+@lru_cache(maxsize=256)
+def build_date_keyboard(today, selection, back, earliest_today, versions):
+    # `versions` are the availability index versions of the offered dates, so any booking change misses
+    # the cache. Days without a single free slot for the duration are left out.
     keyboard = []
-    for date in dates:
+    for i in range(BOOKING_DAYS):
+        date = today + timedelta(days=i)
+        earliest = earliest_today if i == 0 else OPENING_TIME
+        if not availability_index.free_slot_count(date, selection.duration, earliest, selection.court_id):
+            continue
         formatted_date = format_date_ua(date)
-        callback_data = date.strftime("%Y-%m-%d")  # Use a standard date format for callback data
-        keyboard.append([InlineKeyboardButton(formatted_date, callback_data=callback_data)])
+        keyboard.append([InlineKeyboardButton(formatted_date, callback_data=encode('date', replace(selection, date=date)))])
 
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='back_to_duration')])  # Back button
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if not keyboard:
+        return None
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=back)])  # Back button
+    return InlineKeyboardMarkup(keyboard)
+
+async def get_date_keyboard(selection):
+    today = timezone.localdate()
+    dates = [today + timedelta(days=i) for i in range(BOOKING_DAYS)]
+    await repository.ensure_availability(dates)
+
+    # With a single court the court step is skipped, so going back leads to the durations
+    if len(availability_index.courts) > 1:
+        back = encode('back_court', Selection(duration=selection.duration))
+    else:
+        back = encode('back_duration')
+    return build_date_keyboard(
+        today, selection, back, get_earliest_time(today),
+        tuple(availability_index.version(date) for date in dates)
+    )
+
+async def show_dates(query, selection):
+    reply_markup = await get_date_keyboard(selection)
+    await query.answer()
+    if reply_markup is None:
+        await query.edit_message_text("⛔ Найближчі 2 тижні немає вільних часових слотів на цю тривалість.")
+        return ConversationHandler.END
 
     await query.edit_message_text(
         "📅 Оберіть дату (максимум 2 тижні у майбутньому):",
         reply_markup=reply_markup
     )
-    return DATE_SELECTION
-
-
-@sync_to_async
-def get_reserved_times(date_str):
-    # Convert the string to a datetime.date object
-    date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-    reservations = Reservation.objects.filter(start_date=date)
-    reserved_times = []
-    for reservation in reservations:
-        # Convert reservation.start_time (which is a time object) to a datetime object
-        start_datetime = datetime.combine(date, reservation.start_time)
-        end_datetime = start_datetime + timedelta(minutes=reservation.duration)
-        reserved_times.append((start_datetime.time(), end_datetime.time()))
-    return reserved_times
+    return ConversationHandler.END
 
-async def select_time(update: Update, context: CallbackContext):
+async def select_date(update: Update, context: CallbackContext):
     query = update.callback_query
+    selection = read_selection(query)
+    if selection is None:
+        return await expired_button(query)
 
-    # Handle back navigation
-    if query.data == 'back_to_date':  # Handle back to date selection
-        return await select_date(update, context)  # Return to date selection
-    elif query.data == 'back_to_duration':  # Handle back to duration selection
-        return await start_reservation(update, context)  # Return to duration selection
+    return await show_dates(query, selection)
 
-    await query.answer()
 
-    # Parse the selected date
-    context.user_data['reservation_date'] = query.data
-    duration = context.user_data['reservation_duration']
+def get_earliest_time(selected_date):
+    now = timezone.localtime()
+    if selected_date != now.date():
+        return OPENING_TIME  # Start at 9:00 AM
 
-    selected_date = datetime.strptime(context.user_data['reservation_date'], "%Y-%m-%d").date()
-    formatted_date = format_date_ua(selected_date)
-    today = datetime.today().date()
+    # Start at the next half-hour slot or at 9:00 AM, whichever is later
+    minutes = (now.hour * 60 + now.minute) // SLOT_MINUTES * SLOT_MINUTES + SLOT_MINUTES
+    return max(minutes, OPENING_TIME)
 
-    if selected_date == today:
-        now = datetime.now()
-        # Calculate the next half-hour slot
-        minutes = (now.minute // 30 + 1) * 30
-        if minutes == 60:
-            now = now.replace(hour=now.hour + 1, minute=0)
-        else:
-            now = now.replace(minute=minutes)
+@lru_cache(maxsize=512)
+def build_time_keyboard(selection, earliest_time, version):
+    # `version` is the availability index version of the date, so any booking change misses the cache.
+    # With no court_id a time is offered while any court is free then.
+    free_times = availability_index.free_start_times(
+        selection.date, selection.duration, earliest_time, selection.court_id
+    )
+    if not free_times:
+        return None
 
-        earliest_time = max(now.hour * 60 + now.minute, 9 * 60)  # Start at 9:00 AM or the current time
-    else:
-        earliest_time = 9 * 60  # Start at 9:00 AM
+    keyboard = [
+        [InlineKeyboardButton(format_time(minutes), callback_data=encode('time', replace(selection, time=minutes)))]
+        for minutes in free_times
+    ]
+    back = encode('back_date', replace(selection, date=None))
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=back)])  # Back button to date selection
+    return InlineKeyboardMarkup(keyboard)
 
-    latest_start_time = 23 * 60 - duration  # Calculate the latest possible start time in minutes
+async def get_time_keyboard(selection):
+    # Only reaches the database when the background refresh has not loaded the date yet
+    await repository.ensure_availability([selection.date])
 
-    reserved_times = await get_reserved_times(context.user_data['reservation_date'])
+    return build_time_keyboard(
+        selection, get_earliest_time(selection.date), availability_index.version(selection.date)
+    )
 
-    available_times = []
-    for time_in_minutes in range(earliest_time, latest_start_time + 1, 30):
-        hours = time_in_minutes // 60
-        minutes = time_in_minutes % 60
-        proposed_start = time(hours, minutes)
-        proposed_end = (datetime.combine(selected_date, proposed_start) + timedelta(minutes=duration)).time()
+async def select_time(update: Update, context: CallbackContext):
+    query = update.callback_query
+    selection = read_selection(query)
+    if selection is None:
+        return await expired_button(query)
 
-        overlap = any(start <= proposed_start < end or start < proposed_end <= end for start, end in reserved_times)
+    await query.answer()
 
-        if not overlap:
-            available_times.append(f"{hours:02d}:{minutes:02d}")
+    formatted_date = format_date_ua(selection.date)
+    reply_markup = await get_time_keyboard(selection)
 
-    if not available_times:
+    if reply_markup is None:
         await query.edit_message_text("⛔ На вибрану дату немає доступних часових слотів.")
         return ConversationHandler.END
 
-    keyboard = [[InlineKeyboardButton(time, callback_data=time)] for time in available_times]
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='back_to_date')])  # Back button to date selection
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await query.edit_message_text(
         f"🕒 Оберіть час для {formatted_date}:",
         reply_markup=reply_markup
     )
-    return TIME_SELECTION
-
-async def back_to_time_selection(update: Update, context: CallbackContext):
-    query = update.callback_query
-    await query.answer()
-
-    duration = context.user_data['reservation_duration']
-    selected_date = context.user_data['reservation_date']
-
-    # Recalculate available times
-    latest_start_time = 23 * 60 - duration
-    reserved_times = await get_reserved_times(selected_date)
-
-    available_times = []
-    for time_in_minutes in range(9 * 60, latest_start_time + 1, 30):
-        hours = time_in_minutes // 60
-        minutes = time_in_minutes % 60
-        proposed_start = time(hours, minutes)
-        proposed_end = (
-            datetime.combine(datetime.strptime(selected_date, "%Y-%m-%d").date(), proposed_start) + timedelta(
-                minutes=duration)).time()
-
-        overlap = any(start <= proposed_start < end or start < proposed_end <= end for start, end in reserved_times)
-
-        if not overlap:
-            available_times.append(f"{hours:02d}:{minutes:02d}")
-
-    keyboard = [[InlineKeyboardButton(time, callback_data=time)] for time in available_times]
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='back_to_date')])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return ConversationHandler.END
 
-    await query.edit_message_text(
-        f"⏰ Оберіть час для {selected_date}:",
-        reply_markup=reply_markup
-    )
-    return TIME_SELECTION
+def weeks_ua(weeks):
+    # "1 тиждень", "4 тижні", "8 тижнів"
+    if weeks % 10 == 1 and weeks % 100 != 11:
+        return f"{weeks} тиждень"
+    if 2 <= weeks % 10 <= 4 and not 12 <= weeks % 100 <= 14:
+        return f"{weeks} тижні"
+    return f"{weeks} тижнів"
+
+@lru_cache(maxsize=512)
+def build_contacts_keyboard(selection):
+    # Repeating weekly is opt-in: a one-off booking goes straight on to typing the contact details
+    keyboard = [
+        [InlineKeyboardButton(f"🔁 Щотижня, {weeks_ua(weeks)}", callback_data=encode('repeat', replace(selection, weeks=weeks)))]
+        for weeks in REPEAT_WEEKS if weeks != selection.weeks
+    ]
+    if (selection.weeks or 1) > 1:
+        keyboard.append([InlineKeyboardButton("1️⃣ Лише цей раз", callback_data=encode('repeat', replace(selection, weeks=1)))])
+    back = encode('back_time', replace(selection, time=None, weeks=None))
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=back)])
+    return InlineKeyboardMarkup(keyboard)
 
 async def collect_name_phone(update: Update, context: CallbackContext):
     query = update.callback_query
-    await query.answer()
+    selection = read_selection(query)
+    if selection is None:
+        return await expired_button(query)
 
-    if query.data == 'back_to_time_selection':  # Handle back to time selection
-        return await back_to_time_selection(update, context)
-    elif query.data == 'back_to_date':  # Handle back to date selection
-        return await select_date(update, context)
+    await query.answer()
 
-    context.user_data['reservation_time'] = query.data
+    # The text message that follows carries no callback data, so this one token is all that is kept
+    context.user_data['reservation'] = query.data
 
-    keyboard = [
-        [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_time_selection')]  # Back button to time selection
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        "📞 Будь ласка, введіть ваші контактні дані (Наприклад: Андрій Шевченко, +380501234567, коментар):",
-        reply_markup=reply_markup
-    )
+    text = "📞 Будь ласка, введіть ваші контактні дані (Наприклад: Андрій Шевченко, +380501234567, коментар):"
+    if (selection.weeks or 1) > 1:
+        text = f"🔁 Бронювання щотижня о {format_time(selection.time)}, {weeks_ua(selection.weeks)}.\n\n" + text
+    await query.edit_message_text(text, reply_markup=build_contacts_keyboard(selection))
     return NAME_PHONE
 
-@sync_to_async
-def create_reservation(date, time_str, duration, text, username):
-    # Convert date and time_str to datetime objects
-    reservation_date = datetime.strptime(date, "%Y-%m-%d").date()
-    reservation_time = datetime.strptime(time_str, "%H:%M").time()
-    reservation_datetime = datetime.combine(reservation_date, reservation_time)
+async def create_reservation(selection, text, username, chat_id):
+    reservation_time = dt_time(selection.time // 60, selection.time % 60)
 
     # Check if the reservation datetime is in the past
-    if reservation_datetime < datetime.now():
+    if local_datetime(selection.date, reservation_time) < timezone.now():
         return None, "⛔ Ви не можете забронювати на минулу дату або час."
 
-    # Calculate end time of the new reservation
-    new_end_time = (reservation_datetime + timedelta(minutes=duration)).time()
-
-    # Fetch reservations on the same date to check for overlapping times
-    existing_reservations = Reservation.objects.filter(start_date=reservation_date)
-
-    for existing_reservation in existing_reservations:
-        # Calculate the end time of the existing reservation
-        existing_end_time = (datetime.combine(existing_reservation.start_date, existing_reservation.start_time) +
-                             timedelta(minutes=existing_reservation.duration)).time()
-
-        # Check for overlap: the start time of one is between the start and end of the other
-        if (existing_reservation.start_time <= reservation_time < existing_end_time) or \
-           (reservation_time <= existing_reservation.start_time < new_end_time):
-            return None, "⛔ На цей час вже існує бронювання. Будь ласка, оберіть інший час."
-
-    # If no overlaps and the date is valid, create the reservation
-    reservation = Reservation.objects.create(
-        start_date=reservation_date,
-        start_time=reservation_time,
-        duration=duration,
-        text=text,
-        username=username
+    reservation = await repository.book(
+        selection.date, reservation_time, selection.duration, selection.court_id,
+        text=text, username=username, chat_id=chat_id
     )
+    if reservation is None:
+        if selection.court_id is not None:
+            return None, "⛔ Цей стіл на цей час вже заброньовано. Будь ласка, оберіть інший час."
+        return None, "⛔ На цей час вже існує бронювання. Будь ласка, оберіть інший час."
 
     return reservation, None
 
+async def create_series(selection, text, username, chat_id):
+    # The same time every week for selection.weeks weeks, the weeks already taken are skipped
+    reservation_time = dt_time(selection.time // 60, selection.time % 60)
+
+    if local_datetime(selection.date, reservation_time) < timezone.now():
+        return [], [], "⛔ Ви не можете забронювати на минулу дату або час."
+
+    reservations, skipped = await repository.book_series(
+        selection.date, reservation_time, selection.duration, selection.weeks, selection.court_id,
+        text=text, username=username, chat_id=chat_id
+    )
+    if not reservations:
+        return [], skipped, "⛔ На цей час усі тижні вже заброньовано. Будь ласка, оберіть інший час."
+
+    return reservations, skipped, None
+
 async def confirm_reservation(update: Update, context: CallbackContext):
     user_input = update.message.text
+    try:
+        _, selection = decode(context.user_data.get('reservation', ''))
+    except InvalidCallbackData:
+        await update.message.reply_text("⚠️ Бронювання застаріло. Почніть знову: /start")
+        return ConversationHandler.END
+
     try:
         text = user_input.strip()
         username = update.message.from_user.username
 
-        # Get the selected duration
-        duration = context.user_data['reservation_duration']
         # Determine the price based on the duration
-        price = DURATION_TO_PRICE.get(duration, 0)  # Default to 0 if not found
-
-        # Try to create the reservation
-        reservation, error_message = await create_reservation(
-            context.user_data['reservation_date'],
-            context.user_data['reservation_time'],
-            duration,
-            text,
-            username
-        )
+        price = DURATION_TO_PRICE.get(selection.duration, 0)  # Default to 0 if not found
+
+        # Try to create the reservation, or every week of the series at once
+        if (selection.weeks or 1) > 1:
+            reservations, skipped, error_message = await create_series(
+                selection, text, username, update.effective_chat.id
+            )
+        else:
+            reservation, error_message = await create_reservation(selection, text, username, update.effective_chat.id)
+            reservations, skipped = [reservation] if reservation else [], []
 
-        if reservation is None:
+        if not reservations:
             # If there was an error in reservation creation (like overlap or past datetime)
             await update.message.reply_text(error_message)
             return NAME_PHONE
 
-        reservation_date = datetime.strptime(context.user_data['reservation_date'], '%Y-%m-%d')
+        start_time = format_time(selection.time)
+        end_time = format_time((selection.time + selection.duration) % (24 * 60))
+        courts = ', '.join(dict.fromkeys(reservation.court.name for reservation in reservations))
+        dates = ', '.join(format_date_ua(reservation.start_date, escaped=True) for reservation in reservations)
+        taken = ''
+        if skipped:
+            skipped_dates = ', '.join(format_date_ua(date, escaped=True) for date in skipped)
+            taken = f"⛔ *Вже зайнято, не заброньовано:* {skipped_dates}\n"
         # If reservation was successfully created
         await update.message.reply_text(
-            f"🏓 *Бронь столу*\n\n"
-            f"📅 *Дата:* {format_date_ua(reservation_date, escaped=True)}\n"
-            f"🕔 *Час:* {context.user_data['reservation_time']} \\- "
-            f"{(datetime.strptime(context.user_data['reservation_time'], '%H:%M') + timedelta(minutes=duration)).strftime('%H:%M')}\n"
-            f"💵 *До сплати:* {price} грн\n"
+            f"🏓 *Бронь столу:* {escape_markdown(courts, version=2)}\n\n"
+            f"📅 *{'Дати' if len(reservations) > 1 else 'Дата'}:* {dates}\n"
+            f"🕔 *Час:* {start_time} \\- {end_time}\n"
+            f"{taken}"
+            f"💵 *До сплати:* {price * len(reservations)} грн\n"
             "💳 *Карта:* 4323347359089262\n\n"
-            "⏳ *Чекаємо на оплату впродовж 15\\-ти хвилин*\n\n"
+            f"⏳ *Чекаємо на оплату впродовж {settings.RESERVATION_HOLD_MINUTES}\\-ти хвилин*\n\n"
             "✅ Після оплати чекайте на підтвердження від адміністратора \\(\\@nastilnyy\\_tenis\\)",
             parse_mode='MarkdownV2'
         )
-
-        # Notify admin bot
-        await notify_admins(reservation.id, context.user_data['reservation_date'], context.user_data['reservation_time'], duration, text, username)
+        context.user_data.pop('reservation', None)
 
     except ValueError:
         await update.message.reply_text(
@@ -323,31 +368,73 @@ async def confirm_reservation(update: Update, context: CallbackContext):
 
     return ConversationHandler.END
 
-@sync_to_async
-def get_admin_sessions():
-    return list(AdminSession.objects.values_list('chat_id', flat=True))
-
-async def notify_admins(reservation_id, date, time, duration, text, username):
-    message = f"🔔 Нове бронювання на {date} о {time} на {duration / 60} години.\n"
-    message += f"📋 Контактні дані: {text}\n"
-    message += f"💬 Telegram: @{username}"
-
-    keyboard = [
-        [InlineKeyboardButton("✅ Confirm", callback_data=f'confirm_{reservation_id}'),
-         InlineKeyboardButton("❌ Cancel", callback_data=f'cancel_{reservation_id}')]
+def format_expired(reservations):
+    reason = f"оскільки оплату не було отримано впродовж {settings.RESERVATION_HOLD_MINUTES} хвилин"
+    slots = [
+        f"{format_date_ua(reservation.start_date)} о {reservation.start_time.strftime('%H:%M')}"
+        for reservation in reservations
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if len(slots) == 1:
+        return f"⌛ Ваше бронювання на {slots[0]} скасовано, {reason}."
+    return f"⌛ Ваші бронювання скасовано, {reason}:\n" + "\n".join(f"• {slot}" for slot in slots)
+
+async def sweep_unpaid():
+    expired = await repository.sweep_unpaid(settings.RESERVATION_HOLD_MINUTES, settings.EVENT_RETENTION_DAYS)
+    if not expired:
+        return
+
+    # One message for each user whose bookings were released (every week of an unpaid series at once),
+    # admin_bot.py sums them up for the admins
+    by_chat = {}
+    for reservation in expired:
+        if reservation.chat_id:
+            by_chat.setdefault(reservation.chat_id, []).append(reservation)
+    user_messages = [(chat_id, format_expired(reservations), None) for chat_id, reservations in by_chat.items()]
+    for result in await user_notifier.send_messages(user_messages):
+        if not result.ok:
+            print(f"Error notifying user {result.chat_id}: {result.error}")
+
+async def sweep_unpaid_forever(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_unpaid()
+        except Exception as e:
+            print(f"Error expiring unpaid reservations: {e}")
 
-    admin_sessions = await get_admin_sessions()
+async def load_bookable_days():
+    today = timezone.localdate()
+    await repository.load_availability(today, today + timedelta(days=BOOKING_DAYS - 1))
 
-    for chat_id in admin_sessions:
+async def keep_availability_warm(interval):
+    # Reload the bookable days before their index entries expire, so that no user waits for it
+    while True:
+        await asyncio.sleep(interval)
         try:
-            requests.post(
-                url=f"https://api.telegram.org/bot{settings.ADMIN_BOT_TOKEN}/sendMessage",
-                data={"chat_id": chat_id, "text": message, "reply_markup": reply_markup.to_json()},
-            )
+            await load_bookable_days()
         except Exception as e:
-            print(f"Error notifying admin {chat_id}: {e}")
+            print(f"Error refreshing availability: {e}")
+
+async def update_availability(booking_events):
+    availability_index.apply(booking_events)
+
+# Keeps the availability index in step with bookings made and removed by the other processes
+availability_relay = events.EventRelay(update_availability)
+background_tasks = []
+
+async def start_background_tasks(application):
+    # Updates are only processed once this returns, so the first users find the index loaded
+    await load_bookable_days()
+    background_tasks.append(asyncio.create_task(availability_relay.run(settings.EVENT_POLL_INTERVAL)))
+    background_tasks.append(asyncio.create_task(keep_availability_warm(settings.AVAILABILITY_INDEX_TTL / 2)))
+    if settings.EXPIRY_SWEEP_INTERVAL:
+        background_tasks.append(asyncio.create_task(sweep_unpaid_forever(settings.EXPIRY_SWEEP_INTERVAL)))
+
+async def stop_background_tasks(application):
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await user_notifier.aclose()
 
 
 async def cancel(update: Update, context: CallbackContext):
@@ -375,31 +462,51 @@ async def info(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(info_text, parse_mode='Markdown')
 
 
-if __name__ == '__main__':
-    application = Application.builder().token(settings.RESERVATION_BOT_TOKEN).build()
+def build_application(builder=None, request=None):
+    builder = instrument_builder(builder or Application.builder(), request)
+    persistence = DatabasePersistence('reservation_bot', update_interval=settings.BOT_PERSISTENCE_INTERVAL)
+    application = (
+        builder.token(settings.RESERVATION_BOT_TOKEN).persistence(persistence)
+        .post_init(start_background_tasks).post_shutdown(stop_background_tasks).build()
+    )
 
     start_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(start_reservation, pattern='start_reservation')],
+        # Every tap is an entry point, so a tap on any earlier keyboard works in whatever process receives it
+        entry_points=[
+            CallbackQueryHandler(start_reservation, pattern=r'^(start_reservation$|back_duration:)'),
+            CallbackQueryHandler(select_court, pattern=r'^(duration|back_court):'),
+            CallbackQueryHandler(select_date, pattern=r'^(court|back_date):'),
+            CallbackQueryHandler(select_time, pattern=r'^(date|back_time):'),
+            CallbackQueryHandler(collect_name_phone, pattern=r'^(time|repeat):'),
+        ],
         states={
-            DURATION_SELECTION: [CallbackQueryHandler(select_date)],
-            DATE_SELECTION: [CallbackQueryHandler(select_time)],
-            TIME_SELECTION: [
-                CallbackQueryHandler(collect_name_phone),
-                CallbackQueryHandler(select_date, pattern='back_to_date')
-            ],
-            NAME_PHONE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_reservation),
-                CallbackQueryHandler(back_to_time_selection, pattern='back_to_time_selection')
-            ],
+            NAME_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_reservation)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
         per_chat=True,
         allow_reentry=True,
+        # Survives restarts together with the slot token in user_data
+        name='booking',
+        persistent=True,
+    )
+
+    # Drops repeated taps and floods before they reach the conversation
+    throttle = UpdateThrottle(
+        settings.RATE_LIMIT_PER_CHAT, settings.RATE_LIMIT_BURST, settings.DUPLICATE_TAP_WINDOW,
+        settings.BOT_GLOBAL_RATE, busy_text="⏳ Забагато натискань, зачекайте секунду.",
     )
+    application.add_handler(TypeHandler(Update, throttle.throttle), group=-1)
 
     # Add the /info command handler
     application.add_handler(CommandHandler("info", info))
     application.add_handler(CommandHandler("start", start))
     application.add_handler(start_conv_handler)
+    return instrument_application(application, 'reservation_bot')
 
-    application.run_polling()
+
+if __name__ == '__main__':
+    if settings.BOT_MODE == 'webhook':
+        # Both bots are served by the ASGI application (tennis_reservation_app.asgi) instead
+        print("BOT_MODE is 'webhook', not polling.")
+    else:
+        build_application().run_polling()
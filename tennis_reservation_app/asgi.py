@@ -3,6 +3,9 @@ ASGI config for tennis_reservation_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+With BOT_MODE=webhook the same process also serves both Telegram bots through
+their webhooks, see app.webhooks.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -14,3 +17,23 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tennis_reservation_app.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.BOT_MODE == 'webhook':
+    from telegram.ext import Application
+
+    import admin_bot
+    import reservation_bot
+    from app.webhooks import TelegramWebhookRouter
+
+    application = TelegramWebhookRouter(
+        application,
+        [
+            reservation_bot.build_application(Application.builder().updater(None)),
+            admin_bot.build_application(Application.builder().updater(None)),
+        ],
+        secret_token=settings.WEBHOOK_SECRET,
+        webhook_url=settings.WEBHOOK_URL,
+        metrics_token=settings.METRICS_TOKEN,
+    )
@@ -75,12 +75,40 @@ WSGI_APPLICATION = 'tennis_reservation_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db/db.sqlite3',
+# DB_ENGINE selects the backend: "sqlite" (default, a file shared by all containers) or "postgresql"
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'tennis_reservation'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db/db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a writer waits for another process's lock before "database is locked"
+                'timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+            },
+        }
+    }
+
+# Keep connections open between calls, the bots have no request cycle to close them anyway
+DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Database threads used by the bots' async handlers, each keeps its own persistent connection.
+# 1 runs every query on a single shared thread, more gives the bot a pool of connections.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 1))
 
 
 # Password validation
@@ -127,3 +155,51 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ADMIN_BOT_TOKEN = os.getenv('ADMIN_BOT_TOKEN')
 RESERVATION_BOT_TOKEN = os.getenv('RESERVATION_BOT_TOKEN')
+
+# Seconds a day cached in the in-memory availability index is trusted before it is reloaded
+AVAILABILITY_INDEX_TTL = int(os.getenv('AVAILABILITY_INDEX_TTL', 60))
+
+# Outgoing Telegram notifications
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 8))
+NOTIFY_RETRIES = int(os.getenv('NOTIFY_RETRIES', 3))
+
+# How the bots receive updates: "polling" (each bot process long-polls Telegram) or
+# "webhook" (both bots are served by the ASGI application at WEBHOOK_URL)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
+# Seconds between structured handler metrics log lines from the bots, 0 disables them.
+# In webhook mode the same metrics are also served in Prometheus format at /metrics, to scrapers
+# sending "Authorization: Bearer <METRICS_TOKEN>"; without a METRICS_TOKEN there is no /metrics.
+METRICS_LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', 60))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Seconds the list of logged-in admins is cached by a process before it is re-read
+ADMIN_SESSION_CACHE_TTL = int(os.getenv('ADMIN_SESSION_CACHE_TTL', 300))
+# Days an admin bot /login stays valid
+ADMIN_SESSION_DAYS = int(os.getenv('ADMIN_SESSION_DAYS', 30))
+
+# Unconfirmed reservations are released this many minutes after they were made
+RESERVATION_HOLD_MINUTES = int(os.getenv('RESERVATION_HOLD_MINUTES', 15))
+# Seconds between two runs of the sweeper that releases them
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', 60))
+
+# Seconds between writes of the reservation bot's conversation states and user data to the database.
+# Changes are batched in memory in between, a restart loses at most this much.
+BOT_PERSISTENCE_INTERVAL = int(os.getenv('BOT_PERSISTENCE_INTERVAL', 10))
+
+# Seconds between two reads of the booking event outbox by each bot process
+EVENT_POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', 1))
+# Handled booking events are deleted after this many days
+EVENT_RETENTION_DAYS = int(os.getenv('EVENT_RETENTION_DAYS', 7))
+
+# Per-chat limits of the reservation bot, see app/ratelimit.py; 0 disables a limit.
+# Repeated taps on the same button within DUPLICATE_TAP_WINDOW seconds count once,
+# and each chat may send RATE_LIMIT_PER_CHAT updates a second in bursts of RATE_LIMIT_BURST.
+DUPLICATE_TAP_WINDOW = float(os.getenv('DUPLICATE_TAP_WINDOW', 1))
+RATE_LIMIT_PER_CHAT = float(os.getenv('RATE_LIMIT_PER_CHAT', 2))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 5))
+# Updates handled a second by the whole bot before they are made to wait, below Telegram's ~30 messages a second
+BOT_GLOBAL_RATE = float(os.getenv('BOT_GLOBAL_RATE', 25))
@@ -17,6 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from app.views import export_reservations
+
 urlpatterns = [
+    # Before admin/, which would otherwise claim the URL
+    path('admin/reservations/export/', export_reservations, name='export_reservations'),
     path('admin/', admin.site.urls),
 ]